@@ -31,7 +31,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'main_app',
+    'main_app.apps.MainAppConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -42,11 +42,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main_app.metrics.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main_app.routers.ReplicaRoutingMiddleware',
+    'main_app.permissions.PermissionCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,13 +78,24 @@ WSGI_APPLICATION = 'IoU2.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# connections stay open between requests for CONN_MAX_AGE seconds, so each gunicorn thread reuses its own
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', 600))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'IoU2'
+        'NAME': 'IoU2',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
     }
 }
 
+# read-only views in REPLICA_VIEWS read from DATABASE_REPLICA_URL when it's set
+# a session that writes reads from the primary for the next PRIMARY_STICKY_SECONDS, so it sees its own changes
+DATABASE_ROUTERS = ['main_app.routers.ReplicaRouter']
+DATABASE_REPLICA = None
+REPLICA_VIEWS = ['households_index', 'households_details', 'expenses_detail', 'households_export']
+PRIMARY_STICKY_SECONDS = int(os.environ.get('PRIMARY_STICKY_SECONDS', 10))
+
 # django-guardian settings
 AUTH_USER_MODEL = 'main_app.Member'
 ANONYMOUS_USER_NAME = None
@@ -125,9 +139,140 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
+# Caching
+# household dashboards are cached per viewer under a version number that moves on with every change to the household
+# every web and worker process has to see the same versions, so the dashboard cache, ETags and Last-Modified headers
+# are only switched on with a shared cache, Redis at REDIS_URL
+# without it the local memory cache is per process and household responses are rebuilt on every request
+
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'iou2',
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 5000)),
+            },
+        },
+    }
+SHARED_CACHE = bool(REDIS_URL)
+
+# seconds a cached dashboard or fragment may be served before it is rebuilt even without a change
+DASHBOARD_CACHE_TIMEOUT = 60 * 60
+
+# live dashboard streams (main_app/stream.py): each open stream holds a gunicorn thread, see the Procfile
+# streams check the event log this often for writes from other processes, and end after STREAM_MAX_SECONDS
+STREAM_POLL_INTERVAL = int(os.environ.get('STREAM_POLL_INTERVAL', 5))
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 300))
+# at most this many streams stay open per process, the rest reconnect later
+STREAM_MAX_OPEN = int(os.environ.get('STREAM_MAX_OPEN', 16))
+
+# Request metrics
+# every request is logged as JSON to the main_app.metrics logger, set METRICS_LOG_LEVEL=INFO to see them all
+# requests over their view's query budget below are logged as warnings, and QueryBudgetTests fails on the paths it
+# covers (see main_app/testing.py): reads, writes and rejections alike, each budget covers every method of its view
+# write budgets leave room for the two queries of the ledger snapshot taken every LEDGER_SNAPSHOT_INTERVAL events
+
+QUERY_BUDGETS = {
+    'households_index': 7,
+    'households_details': 17,
+    'households_expenses': 14,
+    'households_settle': 15,
+    'households_stats': 8,
+    'households_update': 18,
+    'api_households': 5,
+    'api_household': 7,
+    'api_ledger': 7,
+    'api_expenses': 9,
+    'expenses_search': 8,
+    'households_export': 9,
+    'households_import': 26,
+    'expenses_detail': 10,
+    'add_expense': 34,
+    'has_paid': 16,
+    'has_paid_split': 16,
+    'remove_expense': 20,
+}
+
+# addresses allowed to scrape /metrics/
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'main_app.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('METRICS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 STATIC_URL = '/static/'
+
+# Avatars
+# uploads are resized into square WebP renditions on a pool of AVATAR_WORKERS threads and stored through AVATAR_STORAGE
+# main_app.avatars.FileSystemAvatarStorage keeps them under AVATAR_ROOT instead of S3 for local development
+
+AVATAR_STORAGE = os.environ.get('AVATAR_STORAGE', 'main_app.avatars.S3AvatarStorage')
+AVATAR_BUCKET = 'iou2'
+AVATAR_ROOT = os.path.join(BASE_DIR, 'avatars')
+AVATAR_URL = '/avatars/'
+AVATAR_SIZES = [300, 100, 48]
+AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 2))
+
+# Background jobs
+# household deletes, permission cleanup, balance rebuilds and background exports are queued as main_app.models.Job rows
+# and run by `python manage.py run_jobs` (the worker process in the Procfile), JOB_BATCH_SIZE rows per transaction
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 500))
+JOB_RETRY_DELAY = 30
+JOB_LOCK_TIMEOUT = 600
+# expenses whose splits have all been paid are moved to the archive tables once they are this old
+# (`python manage.py archive_expenses`, or the archive_expenses job)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+# background exports are written by the worker to EXPORT_STORAGE and downloaded from there by the web processes
+# main_app.exports.FileSystemExportStorage keeps them under EXPORT_ROOT for local development
+EXPORT_STORAGE = os.environ.get('EXPORT_STORAGE', 'main_app.exports.S3ExportStorage')
+EXPORT_BUCKET = 'iou2'
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+
 LOGIN_REDIRECT_URL = '/households/'
 LOGOUT_REDIRECT_URL = '/'
 
-import django_heroku
-django_heroku.settings(locals())
\ No newline at end of file
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Heroku sets the database, static files and allowed hosts from the dyno's environment
+# it's optional: installs without the package, or with DJANGO_HEROKU=0, skip it and its imports at boot
+django_heroku = None
+if os.environ.get('DJANGO_HEROKU', '1') != '0':
+    try:
+        import django_heroku
+    except ImportError:
+        pass
+if django_heroku:
+    django_heroku.settings(locals(), logging=False)
+
+# tests read the replica through its own connection to the test database, standing in for replication
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+if os.environ.get('DATABASE_REPLICA_URL'):
+    import dj_database_url
+    DATABASES['replica'] = dict(dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=CONN_MAX_AGE),
+                                TEST={'MIRROR': 'default'})
+    DATABASE_REPLICA = 'replica'
\ No newline at end of file
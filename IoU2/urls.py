@@ -13,6 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -21,3 +23,6 @@ urlpatterns = [
     path('', include('main_app.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
 ]
+
+# avatars kept on the local filesystem are served by the dev server (static() does nothing when DEBUG is off)
+urlpatterns += static(settings.AVATAR_URL, document_root=settings.AVATAR_ROOT)
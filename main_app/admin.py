@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserChangeForm
 from guardian.admin import GuardedModelAdmin
 
-from .models import Household, Member, Expense, Split
+from .models import Household, Member, Expense, Split, Balance, Settlement, LedgerEvent, Job
 
 class MyUserChangeForm(UserChangeForm):
     class Meta(UserChangeForm.Meta):
@@ -20,3 +20,7 @@ admin.site.register(Member, MyUserAdmin)
 admin.site.register(Household)
 admin.site.register(Expense)
 admin.site.register(Split)
+admin.site.register(Balance)
+admin.site.register(Settlement)
+admin.site.register(LedgerEvent)
+admin.site.register(Job)
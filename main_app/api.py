@@ -0,0 +1,160 @@
+import hashlib
+import heapq
+from functools import wraps
+
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
+
+from .caching import household_modified, household_version, versioned_caching
+from .feeds import PAGE_SIZE, cursor_for, decode_cursor
+from .archive import decode_splits
+from .models import ArchivedExpense, Balance, Expense, Household, Job, Member, Split
+
+# read-only JSON for the mobile client, built from values() rows rather than model instances
+# every response carries an ETag and Last-Modified from the household's version, so polling mostly gets 304s
+
+# api clients get a 401 instead of the login page redirect
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return HttpResponse(status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+# ETags vary on the viewer, whose permissions decide what they can see
+def household_etag(request, household):
+    if not versioned_caching():
+        return None
+    return f'api.{household.id}.{household_version(household.id)}.{request.user.id}'
+
+def household_last_modified(request, household):
+    if not versioned_caching():
+        return None
+    return household_modified(household.id)
+
+def households_etag(request):
+    if not versioned_caching():
+        return None
+    versions = [(household_id, household_version(household_id)) for household_id in user_household_ids(request.user)]
+    return hashlib.md5(f'{request.user.id}:{versions}'.encode()).hexdigest()
+
+def user_household_ids(user):
+    return sorted(user.households.values_list('id', flat=True))
+
+# responses are gzipped for clients that accept it
+# permissions are checked before the conditional headers, so a 401 never carries the household's ETag
+def household_endpoint(view):
+    conditional_view = condition(etag_func=household_etag, last_modified_func=household_last_modified)(view)
+
+    @wraps(view)
+    def wrapper(request, household_id):
+        household = get_object_or_404(Household.objects.only('id', 'name'), pk=household_id)
+        if not request.perms.has_perm("view_household", household):
+            return HttpResponse(status=401)
+        return conditional_view(request, household)
+    return gzip_page(api_login_required(require_GET(wrapper)))
+
+def json_response(data):
+    response = JsonResponse(data)
+    # clients have to revalidate every time, which is cheap with the ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@gzip_page
+@api_login_required
+@require_GET
+@condition(etag_func=households_etag)
+def api_households(request):
+    households = list(Household.objects.filter(id__in=user_household_ids(request.user)).order_by('id').values('id', 'name'))
+    return json_response({'households': households})
+
+@household_endpoint
+def api_household(request, household):
+    members = list(Member.objects.filter(households=household.id).order_by('id').values('id', 'username', 'avatar'))
+    return json_response({
+        'id': household.id,
+        'name': household.name,
+        'version': household_version(household.id),
+        'members': members,
+    })
+
+# every open balance in the household, and the viewer's net position against each member
+# amounts are positive when the viewer owes them
+@household_endpoint
+def api_ledger(request, household):
+    balances = list(Balance.objects
+        .filter(household=household.id, open_splits__gt=0)
+        .order_by('debtor', 'creditor')
+        .values('debtor', 'creditor', 'amount', 'open_splits'))
+    ledger = {}
+    for balance in balances:
+        if balance['debtor'] == request.user.id:
+            ledger[balance['creditor']] = ledger.get(balance['creditor'], 0) + balance['amount']
+        elif balance['creditor'] == request.user.id:
+            ledger[balance['debtor']] = ledger.get(balance['debtor'], 0) - balance['amount']
+    return json_response({
+        'balances': balances,
+        'ledger': [{'member': member_id, 'amount': amount} for member_id, amount in sorted(ledger.items())],
+    })
+
+# every expense in the household newest first, archived ones included, a page at a time, with its splits
+# ?after=<cursor> continues from the previous page's next_cursor, ?open=1 limits it to expenses with unpaid splits
+@household_endpoint
+def api_expenses(request, household):
+    expenses = Expense.objects.filter(household=household.id)
+    archived = ArchivedExpense.objects.filter(household=household.id)
+    if request.GET.get('open'):
+        expenses = expenses.filter(id__in=Split.objects.filter(expense__household=household.id, has_paid=False).values('expense'))
+        # archived expenses were all settled
+        archived = archived.none()
+    cursor = request.GET.get('after')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return HttpResponse(status=400)
+        date, expense_id = position
+        after = Q(date__lt=date) | Q(date=date, id__lt=expense_id)
+        expenses = expenses.filter(after)
+        archived = archived.filter(after)
+
+    # archived expenses keep their ids, so both sides merge into one (date, id) order
+    fields = ['id', 'name', 'description', 'cost', 'date', 'member']
+    live = expenses.order_by('-date', '-id').values(*fields)[:PAGE_SIZE + 1]
+    old = archived.order_by('-date', '-id').values(*fields, 'splits')[:PAGE_SIZE + 1]
+    page = list(heapq.merge(live, old, key=lambda expense: (expense['date'], expense['id']), reverse=True))[:PAGE_SIZE + 1]
+    next_cursor = None
+    if len(page) > PAGE_SIZE:
+        page = page[:PAGE_SIZE]
+        next_cursor = cursor_for(page[-1]['date'], page[-1]['id'])
+
+    splits = {expense['id']: [] for expense in page if 'splits' not in expense}
+    for split in (Split.objects
+            .filter(expense__in=list(splits))
+            .order_by('id')
+            .values('id', 'expense', 'member', 'amount_owed', 'has_paid')):
+        splits[split.pop('expense')].append(split)
+    for expense in page:
+        expense['archived'] = 'splits' in expense
+        if expense['archived']:
+            expense['splits'] = [{'id': split_id, 'member': member_id, 'amount_owed': amount_owed, 'has_paid': True}
+                                 for split_id, member_id, amount_owed in decode_splits(expense['splits'])]
+        else:
+            expense['splits'] = splits[expense['id']]
+    return json_response({'expenses': page, 'next_cursor': next_cursor})
+
+# progress of a background job the user asked for, finished exports link to their file
+@api_login_required
+@require_GET
+def api_job(request, job_id):
+    job = get_object_or_404(Job.objects.filter(requested_by=request.user).only('id', 'kind', 'status', 'progress', 'total', 'result', 'attempts'), pk=job_id)
+    data = {'id': job.id, 'kind': job.kind, 'status': job.status, 'progress': job.progress, 'total': job.total, 'attempts': job.attempts}
+    if job.kind == Job.EXPORT_HOUSEHOLD and job.status == Job.DONE:
+        data['download'] = reverse('jobs_download', args=[job.id])
+    return json_response(data)
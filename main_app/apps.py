@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MainAppConfig(AppConfig):
     name = 'main_app'
+
+    def ready(self):
+        # registers the signal receivers that keep household versions and the search index current
+        from . import caching, search
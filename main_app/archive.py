@@ -0,0 +1,83 @@
+import json
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from guardian.models import UserObjectPermission
+
+from .models import ArchivedExpense, Expense, Member, SearchTerm, Split
+
+# settled expenses older than this many days are moved to the archive
+def archive_after_days():
+    return getattr(settings, 'ARCHIVE_AFTER_DAYS', 180)
+
+# expenses dated before the cutoff with every split paid, oldest first
+def archivable_expenses(household_id=None, older_than_days=None):
+    days = archive_after_days() if older_than_days is None else older_than_days
+    unpaid_splits = Split.objects.filter(expense=OuterRef('pk'), has_paid=False)
+    expenses = (Expense.objects
+        .filter(date__lt=timezone.now() - timedelta(days=days))
+        .annotate(has_unpaid_splits=Exists(unpaid_splits))
+        .filter(has_unpaid_splits=False))
+    if household_id is not None:
+        expenses = expenses.filter(household=household_id)
+    return expenses.order_by('id')
+
+# moves up to `size` archivable expenses and their splits into the archive, in the caller's transaction
+# their search terms and edit/delete permissions go too, archived expenses are read-only
+# returns how many expenses were archived
+def archive_batch(household_id=None, older_than_days=None, size=500):
+    ids = list(archivable_expenses(household_id, older_than_days).values_list('id', flat=True)[:size])
+    if not ids:
+        return 0
+    splits = defaultdict(list)
+    for expense_id, split_id, member_id, amount_owed in (Split.objects
+            .filter(expense__in=ids)
+            .order_by('id')
+            .values_list('expense', 'id', 'member', 'amount_owed')):
+        splits[expense_id].append([split_id, member_id, str(amount_owed)])
+    ArchivedExpense.objects.bulk_create([
+        ArchivedExpense(id=expense_id, household_id=household, member_id=member, name=name, cost=cost, date=date,
+                        description=description, splits=json.dumps(splits[expense_id]))
+        for expense_id, household, member, name, cost, date, description in (Expense.objects
+            .filter(id__in=ids)
+            .values_list('id', 'household', 'member', 'name', 'cost', 'date', 'description'))
+    ])
+    ctype = ContentType.objects.get_for_model(Expense)
+    UserObjectPermission.objects.filter(content_type=ctype, object_pk__in=[str(expense_id) for expense_id in ids]).delete()
+    SearchTerm.objects.filter(expense__in=ids).delete()
+    Split.objects.filter(expense__in=ids).delete()
+    Expense.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+def archived_splits(archived_expense):
+    return decode_splits(archived_expense.splits)
+
+# (split id, member id, amount owed) from an archived expense's splits column
+def decode_splits(splits):
+    return [(split_id, member_id, Decimal(amount_owed)) for split_id, member_id, amount_owed in json.loads(splits)]
+
+# the household's archive as export rows, in the same shape and (expense id, split id) order as the live export query
+def archived_export_rows(household_id, chunk_size=2000):
+    usernames = {}
+    archived = (ArchivedExpense.objects
+        .filter(household=household_id)
+        .select_related('member')
+        .order_by('id')
+        .iterator(chunk_size=chunk_size))
+    for expense in archived:
+        splits = archived_splits(expense)
+        missing = {member_id for split_id, member_id, amount_owed in splits} - set(usernames)
+        if missing:
+            # members deleted since the expense was archived export with a blank username
+            usernames.update(dict.fromkeys(missing, ''))
+            usernames.update(Member.objects.filter(id__in=missing).values_list('id', 'username'))
+        head = (expense.id, expense.date, expense.name, expense.description, expense.cost, expense.member.username)
+        if not splits:
+            yield head + (None, None, None, None)
+        for split_id, member_id, amount_owed in splits:
+            yield head + (split_id, usernames[member_id], amount_owed, True)
@@ -0,0 +1,134 @@
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Member
+
+logger = logging.getLogger(__name__)
+
+# square WebP renditions made from every upload (settings.AVATAR_SIZES), the largest becomes Member.avatar
+# the others sit next to it as <size>.webp for templates that want a smaller file
+def avatar_sizes():
+    return getattr(settings, 'AVATAR_SIZES', [300, 100, 48])
+
+# AVATAR_WORKERS = 0 processes uploads inline, which is simpler in tests and one-off scripts
+def avatar_workers():
+    return getattr(settings, 'AVATAR_WORKERS', 2)
+
+
+# stores avatars in an S3 bucket through one client shared by every worker thread
+class S3AvatarStorage:
+    base_url = 'https://s3-us-east-2.amazonaws.com/'
+
+    def __init__(self):
+        self.bucket = getattr(settings, 'AVATAR_BUCKET', 'iou2')
+        self.lock = threading.Lock()
+        self.s3 = None
+
+    # boto3 clients are thread safe, so the pool shares one with a connection per worker
+    def client(self):
+        with self.lock:
+            if self.s3 is None:
+                import boto3
+                from botocore.config import Config
+                self.s3 = boto3.session.Session().client('s3', config=Config(max_pool_connections=max(avatar_workers(), 1)))
+            return self.s3
+
+    # every upload gets a fresh key, so the files can be cached forever
+    def save(self, name, content, content_type):
+        key = f'avatars/{name}'
+        self.client().put_object(Bucket=self.bucket, Key=key, Body=content, ContentType=content_type, CacheControl='public, max-age=31536000, immutable')
+        return f'{self.base_url}{self.bucket}/{key}'
+
+
+# writes avatars under AVATAR_ROOT and serves them from AVATAR_URL, for local development and tests
+class FileSystemAvatarStorage:
+    def __init__(self):
+        self.root = getattr(settings, 'AVATAR_ROOT', os.path.join(settings.BASE_DIR, 'avatars'))
+        self.url = getattr(settings, 'AVATAR_URL', '/avatars/')
+
+    def save(self, name, content, content_type):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output:
+            output.write(content)
+        return f'{self.url}{name}'
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = import_string(getattr(settings, 'AVATAR_STORAGE', 'main_app.avatars.S3AvatarStorage'))()
+        return _storage
+
+# dropped when settings change so tests can swap backends
+@receiver(setting_changed)
+def reset_storage(setting, **kwargs):
+    global _storage
+    if setting.startswith('AVATAR_'):
+        with _storage_lock:
+            _storage = None
+
+
+# center crops to a square and encodes one WebP per size, largest first
+# Pillow is imported on first use so web workers don't pay for it at boot
+def renditions(data):
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for size in sorted(avatar_sizes(), reverse=True):
+            output = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, 'WEBP', quality=80, method=4)
+            yield size, output.getvalue()
+
+# resizes and uploads the image, then points the member at the largest rendition
+# returns the new avatar url, or None if the upload wasn't an image the pipeline could read
+def process_avatar(member_id, data):
+    try:
+        key = uuid.uuid4().hex
+        storage = get_storage()
+        url = None
+        for size, content in renditions(data):
+            saved = storage.save(f'{member_id}/{key}/{size}.webp', content, 'image/webp')
+            url = url or saved
+    except Exception:
+        logger.exception('Could not process the avatar for member %s', member_id)
+        return None
+    Member.objects.filter(pk=member_id).update(avatar=url)
+    return url
+
+# worker threads outlive requests, so they close their own database connections after each job
+def _process_in_worker(member_id, data):
+    try:
+        return process_avatar(member_id, data)
+    finally:
+        connections.close_all()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# hands the upload to the worker pool and returns a Future for the new avatar url
+def submit_avatar(member_id, data):
+    global _executor
+    workers = avatar_workers()
+    if not workers:
+        future = Future()
+        future.set_result(process_avatar(member_id, data))
+        return future
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='avatars')
+    return _executor.submit(_process_in_worker, member_id, data)
@@ -0,0 +1,152 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connection
+from django.db.models import F, Q, Sum, Count
+
+from .caching import bump_household_version
+from .ledger import record_event, take_snapshot
+from .models import Balance, Household, LedgerEvent, Member, Split
+
+CENT = Decimal('0.01')
+
+# splits a cost into `parts` whole-cent shares that add back up to the cost exactly
+# leftover cents go one each to the first shares, so no two shares differ by more than a cent
+def split_cost(cost, parts):
+    cents = int((Decimal(cost) / CENT).to_integral_value(rounding=ROUND_HALF_UP))
+    share, remainder = divmod(cents, parts)
+    return [(share + 1) * CENT if index < remainder else share * CENT for index in range(parts)]
+
+# the ledger maps each counterparty to the member's net position against them
+# negative amounts mean the counterparty owes the member, positive amounts mean the member owes the counterparty
+def get_ledger(household_id, member_id):
+    ledger = {}
+    balances = (Balance.objects
+        .filter(household=household_id, open_splits__gt=0)
+        .filter(Q(debtor=member_id) | Q(creditor=member_id))
+        .select_related('debtor', 'creditor'))
+    for balance in balances:
+        if balance.debtor_id == member_id:
+            counterparty, amount = balance.creditor, balance.amount
+        else:
+            counterparty, amount = balance.debtor, -balance.amount
+        ledger[counterparty] = ledger.get(counterparty, 0) + amount
+    return ledger
+
+# same ledger as get_ledger, computed straight from the unpaid splits instead of the balance table
+def compute_ledger(household_id, member_id):
+    totals = {}
+
+    # unpaid splits on expenses the member paid for, grouped by who owes them
+    owed_to_member = (Split.objects
+        .filter(expense__household=household_id, expense__member=member_id, has_paid=False)
+        .values_list('member')
+        .annotate(total=Sum('amount_owed'))
+        .order_by())
+    for counterparty_id, total in owed_to_member:
+        totals[counterparty_id] = totals.get(counterparty_id, 0) - Decimal(total).quantize(CENT)
+
+    # unpaid splits the member owes on expenses other people paid for, grouped by who paid
+    owed_by_member = (Split.objects
+        .filter(expense__household=household_id, member=member_id, has_paid=False)
+        .exclude(expense__member=member_id)
+        .values_list('expense__member')
+        .annotate(total=Sum('amount_owed'))
+        .order_by())
+    for counterparty_id, total in owed_by_member:
+        totals[counterparty_id] = totals.get(counterparty_id, 0) + Decimal(total).quantize(CENT)
+
+    if not totals:
+        return {}
+    members = Member.objects.in_bulk(list(totals))
+    return {members[counterparty_id]: total for counterparty_id, total in totals.items()}
+
+# applies (debtor_id, creditor_id, amount, open_splits) deltas to the balance table
+# callers run this inside the same transaction as the split writes it mirrors
+def apply_balance_changes(household_id, changes):
+    deltas = defaultdict(lambda: [0, 0])
+    for debtor_id, creditor_id, amount, open_splits in changes:
+        if debtor_id == creditor_id:
+            continue
+        deltas[(debtor_id, creditor_id)][0] += amount
+        deltas[(debtor_id, creditor_id)][1] += open_splits
+    if not deltas:
+        return
+    # the bulk writes below skip model signals, so cached dashboards are invalidated here
+    bump_household_version(household_id)
+
+    debtor_ids = {debtor_id for debtor_id, creditor_id in deltas}
+    creditor_ids = {creditor_id for debtor_id, creditor_id in deltas}
+    existing = (Balance.objects
+        .select_for_update()
+        .filter(household=household_id, debtor__in=debtor_ids, creditor__in=creditor_ids))
+    updated = []
+    for balance in existing:
+        key = (balance.debtor_id, balance.creditor_id)
+        if key in deltas:
+            amount, open_splits = deltas.pop(key)
+            balance.amount += amount
+            balance.open_splits += open_splits
+            updated.append(balance)
+    if updated:
+        Balance.objects.bulk_update(updated, ['amount', 'open_splits'])
+    if deltas:
+        Balance.objects.bulk_create([
+            Balance(household_id=household_id, debtor_id=debtor_id, creditor_id=creditor_id, amount=amount, open_splits=open_splits)
+            for (debtor_id, creditor_id), (amount, open_splits) in deltas.items()
+        ])
+
+# totals of unpaid splits per (household, debtor, creditor), straight from the split table
+def expected_balances(household_id=None):
+    splits = Split.objects.filter(has_paid=False).exclude(member=F('expense__member'))
+    if household_id is not None:
+        splits = splits.filter(expense__household=household_id)
+    rows = (splits
+        .values_list('expense__household', 'member', 'expense__member')
+        .annotate(total=Sum('amount_owed'), count=Count('id'))
+        .order_by())
+    # sqlite sums decimals as floats, so totals are rounded back to whole cents
+    return {(household, debtor, creditor): (Decimal(total).quantize(CENT), count) for household, debtor, creditor, total, count in rows}
+
+def rebuild_balances(household_id=None):
+    balances = Balance.objects.all()
+    if household_id is not None:
+        balances = balances.filter(household=household_id)
+    before = {(household, debtor, creditor): (amount, open_splits) for household, debtor, creditor, amount, open_splits in balances.values_list('household', 'debtor', 'creditor', 'amount', 'open_splits')}
+    balances.delete()
+    expected = expected_balances(household_id)
+    rows = [
+        Balance(household_id=household, debtor_id=debtor, creditor_id=creditor, amount=total, open_splits=count)
+        for (household, debtor, creditor), (total, count) in expected.items()
+    ]
+    # an explicit batch_size overrides the backend's limit on parameters per statement, so it's capped at that
+    Balance.objects.bulk_create(rows, batch_size=min(1000, connection.ops.bulk_batch_size(Balance._meta.concrete_fields, rows)))
+
+    # whatever the rebuild corrected goes into the event log too, so replaying it still adds up to the table
+    corrections = defaultdict(list)
+    for household, debtor, creditor in set(before) | set(expected):
+        total, count = expected.get((household, debtor, creditor), (0, 0))
+        old_total, old_count = before.get((household, debtor, creditor), (0, 0))
+        if total != old_total or count != old_count:
+            corrections[household].append((debtor, creditor, total - old_total, count - old_count))
+    for household, changes in corrections.items():
+        take_snapshot(record_event(household, LedgerEvent.BALANCES_REBUILT, changes))
+    household_ids = [household_id] if household_id is not None else Household.objects.values_list('id', flat=True)
+    for household in household_ids:
+        bump_household_version(household)
+    return len(rows)
+
+# returns (household_id, debtor_id, creditor_id, stored, expected) for every pair where the table disagrees with the splits
+def verify_balances(household_id=None):
+    expected = expected_balances(household_id)
+    balances = Balance.objects.all()
+    if household_id is not None:
+        balances = balances.filter(household=household_id)
+    mismatches = []
+    for household, debtor, creditor, amount, open_splits in balances.values_list('household', 'debtor', 'creditor', 'amount', 'open_splits'):
+        total, count = expected.pop((household, debtor, creditor), (0, 0))
+        if count != open_splits or total != amount:
+            mismatches.append((household, debtor, creditor, (amount, open_splits), (total, count)))
+    for (household, debtor, creditor), (total, count) in expected.items():
+        mismatches.append((household, debtor, creditor, (0, 0), (total, count)))
+    return mismatches
@@ -0,0 +1,113 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.middleware.csrf import get_token
+
+from .models import Expense, Household, Member, Split
+from .routers import reading_from_replica
+
+# every household has a version number in the cache that moves on whenever its expenses, splits or members change
+# cached ledgers, rendered fragments and ETags all include the version, so bumping it invalidates them at once
+def version_key(household_id):
+    return f'household:{household_id}:version'
+
+# a fresh counter starts from the clock so a flushed cache can't bring back a version clients have already seen
+def initial_version():
+    return int(time.time() * 1000)
+
+def household_version(household_id):
+    version = cache.get(version_key(household_id))
+    if version is None:
+        cache.add(version_key(household_id), initial_version(), timeout=None)
+        version = cache.get(version_key(household_id))
+    return version
+
+# bumps once straight away and again after the surrounding transaction commits, in case a request in between
+# cached the pre-commit data under the first new version
+def bump_household_version(household_id):
+    _bump(household_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(household_id))
+
+def _bump(household_id):
+    try:
+        cache.incr(version_key(household_id))
+    except ValueError:
+        cache.set(version_key(household_id), initial_version(), timeout=None)
+    cache.set(modified_key(household_id), time.time(), timeout=None)
+
+def modified_key(household_id):
+    return f'household:{household_id}:modified'
+
+# when the household's version last moved, for Last-Modified headers
+# a household nobody has written to since the cache started counts as modified now, like a fresh version
+def household_modified(household_id):
+    modified = cache.get(modified_key(household_id))
+    if modified is None:
+        cache.add(modified_key(household_id), time.time(), timeout=None)
+        modified = cache.get(modified_key(household_id))
+    return datetime.fromtimestamp(modified, timezone.utc)
+
+# versions only invalidate every process's copies when the cache holding them is shared between processes
+# (SHARED_CACHE), without one nothing is cached under them and responses go out without validators
+def versioned_caching():
+    return getattr(settings, 'SHARED_CACHE', False)
+
+def dashboard_key(household_id, member_id, version):
+    return f'household:{household_id}:v{version}:dashboard:{member_id}'
+
+# the dashboard's ETag, good until the household changes, the viewer's own navbar details do or the csrf cookie
+# rotates (logging in again does), since a cached page's forms carry tokens for the old one
+# pages read from a replica may be older than the current version, so they go out without one
+def dashboard_etag(request, household_id):
+    if not versioned_caching() or reading_from_replica():
+        return None
+    user = request.user
+    viewer = hashlib.md5(f'{user.username}|{user.avatar}'.encode()).hexdigest()[:8]
+    return f'{household_id}.{household_version(household_id)}.{user.id}.{viewer}.{csrf_fragment_key(request)}'
+
+# fragments holding forms also vary on the csrf cookie, since the token embedded in them belongs to one browser
+def csrf_fragment_key(request):
+    # get_token sets the cookie up for requests that arrive without one
+    get_token(request)
+    return hashlib.md5(request.META['CSRF_COOKIE'].encode()).hexdigest()[:8]
+
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 3600)
+
+def dashboard_cache_timeout():
+    return DASHBOARD_CACHE_TIMEOUT if versioned_caching() else 0
+
+
+# renames show on the dashboard and in the api
+@receiver(post_save, sender=Household)
+def household_changed(sender, instance, created, **kwargs):
+    if not created:
+        bump_household_version(instance.id)
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def expense_changed(sender, instance, **kwargs):
+    bump_household_version(instance.household_id)
+
+# splits are only deleted along with their expense, whose own post_delete covers them
+@receiver(post_save, sender=Split)
+def split_changed(sender, instance, **kwargs):
+    bump_household_version(instance.expense.household_id)
+
+@receiver(m2m_changed, sender=Member.households.through)
+def membership_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # forward changes come from member.households, reverse ones from household.members
+    if isinstance(instance, Member):
+        household_ids = pk_set or []
+    else:
+        household_ids = [instance.pk]
+    for household_id in household_ids:
+        bump_household_version(household_id)
@@ -0,0 +1,120 @@
+import csv
+import heapq
+import json
+import os
+import shutil
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .archive import archived_export_rows
+from .models import Expense
+
+CHUNK_SIZE = 2000
+
+# one row per split, expenses without splits get a single row with empty split columns
+EXPORT_COLUMNS = [
+    ('expense_id', 'id'),
+    ('date', 'date'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('cost', 'cost'),
+    ('paid_by', 'member__username'),
+    ('split_id', 'split__id'),
+    ('split_member', 'split__member__username'),
+    ('amount_owed', 'split__amount_owed'),
+    ('has_paid', 'split__has_paid'),
+]
+
+# live and archived expenses merged in expense id order, both sides are streamed
+def export_rows(household_id, chunk_size=CHUNK_SIZE):
+    live = (Expense.objects
+        .filter(household=household_id)
+        .order_by('id', 'split__id')
+        .values_list(*[field for column, field in EXPORT_COLUMNS])
+        .iterator(chunk_size=chunk_size))
+    return heapq.merge(live, archived_export_rows(household_id, chunk_size), key=lambda row: (row[0], row[6] or 0))
+
+# csv.writer wants a file, this one hands each formatted line straight back instead of buffering it
+class Echo:
+    def write(self, value):
+        return value
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, field in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+def ndjson_lines(rows):
+    columns = [column for column, field in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+# background exports are written by the job worker and downloaded through a web process,
+# so they're kept in the S3 bucket the avatars use rather than on either one's disk
+class S3ExportStorage:
+    def __init__(self):
+        self.bucket = getattr(settings, 'EXPORT_BUCKET', 'iou2')
+        self.lock = threading.Lock()
+        self.s3 = None
+
+    def client(self):
+        with self.lock:
+            if self.s3 is None:
+                import boto3
+                self.s3 = boto3.session.Session().client('s3')
+            return self.s3
+
+    # uploads the file in parts, so a large export is never held in memory
+    def save(self, name, file, content_type):
+        key = f'exports/{name}'
+        self.client().upload_fileobj(file, self.bucket, key, ExtraArgs={'ContentType': content_type})
+        return key
+
+    def open(self, key):
+        return self.client().get_object(Bucket=self.bucket, Key=key)['Body']
+
+
+# keeps exports under EXPORT_ROOT, for local development and tests where the worker shares the web process's disk
+class FileSystemExportStorage:
+    def __init__(self):
+        self.root = getattr(settings, 'EXPORT_ROOT', os.path.join(settings.BASE_DIR, 'exports'))
+
+    def save(self, name, file, content_type):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, name), 'wb') as output:
+            shutil.copyfileobj(file, output)
+        return name
+
+    def open(self, name):
+        return open(os.path.join(self.root, name), 'rb')
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_export_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = import_string(getattr(settings, 'EXPORT_STORAGE', 'main_app.exports.S3ExportStorage'))()
+        return _storage
+
+# dropped when settings change so tests can swap backends
+@receiver(setting_changed)
+def reset_export_storage(setting, **kwargs):
+    global _storage
+    if setting.startswith('EXPORT_'):
+        with _storage_lock:
+            _storage = None
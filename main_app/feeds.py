@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
+
+from .models import Expense, LedgerEvent, Split
+
+PAGE_SIZE = 20
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# cursors are "<microseconds since epoch>-<expense id>" of the last expense on the previous page
+# the microseconds are negative before 1970, so the id is split off the right
+def encode_cursor(expense):
+    return cursor_for(expense.date, expense.id)
+
+def cursor_for(date, expense_id):
+    date = date if timezone.is_aware(date) else timezone.make_aware(date, timezone.utc)
+    return f"{(date - EPOCH) // timedelta(microseconds=1)}-{expense_id}"
+
+def decode_cursor(cursor):
+    try:
+        microseconds, expense_id = (int(part) for part in cursor.rsplit('-', 1))
+        return EPOCH + timedelta(microseconds=microseconds), expense_id
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+# expenses in the household that still have at least one unpaid split, newest first, with their activity
+def open_expenses(household_id):
+    unpaid_splits = Split.objects.filter(expense=OuterRef('pk'), has_paid=False)
+    return (Expense.objects
+        .filter(household=household_id)
+        .annotate(has_unpaid_splits=Exists(unpaid_splits))
+        .filter(has_unpaid_splits=True)
+        .select_related('member')
+        .prefetch_related(Prefetch('events', queryset=LedgerEvent.objects.select_related('actor', 'counterparty').order_by('id')))
+        .order_by('-date', '-id'))
+
+# returns one page of open expenses after the cursor, and the cursor for the next page (None on the last page)
+# raises ValueError for a cursor that doesn't decode
+def expense_page(household_id, cursor=None, page_size=PAGE_SIZE):
+    expenses = open_expenses(household_id)
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise ValueError(f'invalid cursor {cursor!r}')
+        date, expense_id = position
+        expenses = expenses.filter(Q(date__lt=date) | Q(date=date, id__lt=expense_id))
+    page = list(expenses[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
@@ -1,5 +1,6 @@
+from django import forms
 from django.forms import ModelForm
-from .models import Household, Expense
+from .models import Household, Expense, Member
 
 class HouseholdForm(ModelForm):
     class Meta:
@@ -10,3 +11,18 @@ class ExpenseForm(ModelForm):
     class Meta:
         model = Expense
         fields = ['name', 'cost', 'description']
+
+# filters for expense search, the household and member choices are limited to the user's households in the view
+class ExpenseSearchForm(forms.Form):
+    q = forms.CharField(label='Search', max_length=100, required=False)
+    household = forms.ModelChoiceField(queryset=Household.objects.none(), required=False, empty_label='All households')
+    member = forms.ModelChoiceField(queryset=Member.objects.none(), required=False, empty_label='Anyone', label='Paid by')
+    date_from = forms.DateField(required=False, label='From')
+    date_to = forms.DateField(required=False, label='To')
+    min_cost = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='Min cost')
+    max_cost = forms.DecimalField(required=False, min_value=0, decimal_places=2, label='Max cost')
+
+    def __init__(self, *args, households, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['household'].queryset = households
+        self.fields['member'].queryset = Member.objects.filter(households__in=households).distinct().order_by('username')
@@ -0,0 +1,121 @@
+import csv
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from guardian.models import UserObjectPermission
+
+from .balances import apply_balance_changes, split_cost
+from .ledger import record_event
+from .rollups import apply_rollup_changes, expense_rollup_changes
+from .search import index_expenses
+from .models import Expense, LedgerEvent, Split
+
+# description, paid_by and date columns are optional
+# paid_by is a username and defaults to the person importing, date defaults to now
+REQUIRED_COLUMNS = ['name', 'cost']
+BATCH_SIZE = 1000
+
+def parse_cost(value):
+    try:
+        cost = Decimal(value.strip().lstrip('$').replace(',', ''))
+    except InvalidOperation:
+        return None
+    if not cost.is_finite() or cost < 0 or cost >= Decimal('100000000'):
+        return None
+    return cost.quantize(Decimal('0.01'))
+
+def parse_when(value):
+    # well formed values that aren't real dates or times, like 2020-02-30, raise rather than return None
+    try:
+        when = parse_datetime(value)
+        day = parse_date(value) if when is None else None
+    except ValueError:
+        return None
+    if when is None:
+        if day is None:
+            return None
+        when = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+# rows per INSERT, capped by what the database backend accepts in one statement
+def batch_size(model, objs):
+    return min(BATCH_SIZE, connection.ops.bulk_batch_size(model._meta.concrete_fields, objs))
+
+# validates every row of the csv against the household's members in one pass
+# returns (expenses, errors) where errors is a list of (line number, message); expenses are unsaved
+def parse_expenses(household, lines, importing_member):
+    reader = csv.DictReader(lines)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        return [], [(1, f"missing column(s): {', '.join(missing)}")]
+
+    members = {member.username: member.id for member in household.members.only('id', 'username')}
+    now = timezone.now()
+    expenses = []
+    errors = []
+    for row in reader:
+        line = reader.line_num
+        name = (row.get('name') or '').strip()
+        description = (row.get('description') or '').strip()
+        paid_by = (row.get('paid_by') or '').strip() or importing_member.username
+        cost = parse_cost(row.get('cost') or '')
+        date = parse_when(row['date'].strip()) if (row.get('date') or '').strip() else now
+        if not name or len(name) > 100:
+            errors.append((line, 'name must be between 1 and 100 characters'))
+        elif len(description) > 100:
+            errors.append((line, 'description must be at most 100 characters'))
+        elif cost is None:
+            errors.append((line, f"invalid cost {row.get('cost')!r}"))
+        elif paid_by not in members:
+            errors.append((line, f'{paid_by} is not a member of {household.name}'))
+        elif date is None:
+            errors.append((line, f"invalid date {row.get('date')!r}"))
+        else:
+            expenses.append(Expense(household=household, member_id=members[paid_by], name=name, cost=cost, description=description, date=date))
+    return expenses, errors
+
+# saves the parsed expenses with their splits, grants and balance changes in one transaction
+def import_expenses(household, expenses, actor_id=None):
+    member_ids = sorted(household.members.values_list('id', flat=True))
+    ctype = ContentType.objects.get_for_model(Expense)
+    permissions = list(Permission.objects.filter(content_type=ctype, codename__in=['change_expense', 'delete_expense']))
+    with transaction.atomic():
+        Expense.objects.bulk_create(expenses, batch_size=batch_size(Expense, expenses))
+        if not connection.features.can_return_ids_from_bulk_insert:
+            # the insert holds the write lock until commit, so the newest ids in the household are the rows just added
+            ids = list(Expense.objects.filter(household=household).order_by('-id').values_list('id', flat=True)[:len(expenses)])
+            for expense, expense_id in zip(expenses, reversed(ids)):
+                expense.id = expense_id
+
+        splits = []
+        grants = []
+        for expense in expenses:
+            others = [member_id for member_id in member_ids if member_id != expense.member_id]
+            # the payer keeps the first share, which carries any leftover cent
+            shares = split_cost(expense.cost, len(others) + 1)[1:]
+            splits += [Split(expense_id=expense.id, member_id=member_id, amount_owed=share) for member_id, share in zip(others, shares)]
+            grants += [UserObjectPermission(permission=permission, user_id=expense.member_id, content_type=ctype, object_pk=str(expense.id)) for permission in permissions]
+        Split.objects.bulk_create(splits, batch_size=batch_size(Split, splits))
+        UserObjectPermission.objects.bulk_create(grants, batch_size=batch_size(UserObjectPermission, grants))
+        payers = {expense.id: expense.member_id for expense in expenses}
+        changes = [(split.member_id, payers[split.expense_id], split.amount_owed, 1) for split in splits]
+        apply_balance_changes(household.id, changes)
+        # one event for the whole import rather than one per row
+        record_event(household.id, LedgerEvent.EXPENSES_IMPORTED, changes, actor_id=actor_id,
+                     name=f'{len(expenses)} expenses', amount=sum(expense.cost for expense in expenses))
+        shares = defaultdict(list)
+        for split in splits:
+            shares[split.expense_id].append((split.member_id, split.amount_owed))
+        apply_rollup_changes(household.id, [change for expense in expenses
+                                            for change in expense_rollup_changes(expense.member_id, expense.date, expense.cost, shares[expense.id])])
+        # bulk_create skips post_save, so the new rows are indexed here
+        index_expenses(expenses, new=True)
+    return len(expenses)
@@ -0,0 +1,202 @@
+import json
+import logging
+import tempfile
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from .archive import archive_batch
+from .balances import rebuild_balances
+from .exports import EXPORT_FORMATS, export_rows, get_export_storage
+from .models import (ArchivedExpense, Balance, Expense, Household, Job, LedgerEvent, LedgerSnapshot, MonthlySpend, SearchTerm,
+                     Settlement, Split)
+
+logger = logging.getLogger(__name__)
+
+# rows a job handles per transaction, small enough that one batch never holds locks for long
+def batch_size():
+    return getattr(settings, 'JOB_BATCH_SIZE', 500)
+
+# a running job whose worker hasn't reported progress for this long is assumed dead and handed to another worker
+def lock_timeout():
+    return timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 600))
+
+# failed batches are retried after JOB_RETRY_DELAY seconds, doubling with every attempt
+def retry_delay(attempts):
+    return timedelta(seconds=getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (attempts - 1))
+
+
+def enqueue(kind, requested_by=None, **arguments):
+    return Job.objects.create(kind=kind, arguments=json.dumps(arguments), requested_by=requested_by)
+
+
+# each handler runs one batch of its job in a transaction: handler(job, arguments, state) -> (done, rows processed)
+# it updates state in place to remember where it got to, and has to be safe to run again if the batch is retried
+
+# ids of the next batch of rows in the queryset, smallest first
+def next_ids(queryset, size):
+    return list(queryset.order_by('id').values_list('id', flat=True)[:size])
+
+# removes a household's expenses batch by batch, along with their splits, search terms and per-expense permissions,
+# then its history and finally the household itself
+def delete_household(job, arguments, state):
+    household_id = arguments['household_id']
+    size = batch_size()
+    if job.total is None:
+        job.total = Expense.objects.filter(household=household_id).count()
+
+    expense_ids = next_ids(Expense.objects.filter(household=household_id), size)
+    if expense_ids:
+        ctype = ContentType.objects.get_for_model(Expense)
+        UserObjectPermission.objects.filter(content_type=ctype, object_pk__in=[str(expense_id) for expense_id in expense_ids]).delete()
+        SearchTerm.objects.filter(expense__in=expense_ids).delete()
+        Split.objects.filter(expense__in=expense_ids).delete()
+        Expense.objects.filter(id__in=expense_ids).delete()
+        return False, len(expense_ids)
+
+    # snapshots go before the events they point at
+    for model in (ArchivedExpense, LedgerSnapshot, LedgerEvent, MonthlySpend, Settlement, Balance, SearchTerm):
+        ids = next_ids(model.objects.filter(household=household_id), size)
+        if ids:
+            model.objects.filter(id__in=ids).delete()
+            return False, 0
+
+    ctype = ContentType.objects.get_for_model(Household)
+    for permissions in (UserObjectPermission, GroupObjectPermission):
+        permissions.objects.filter(content_type=ctype, object_pk=str(household_id)).delete()
+    Household.objects.filter(pk=household_id).delete()
+    return True, 0
+
+# object permissions whose expense or household no longer exists, in id order from where the last batch stopped
+def cleanup_permissions(job, arguments, state):
+    size = batch_size()
+    models = {ContentType.objects.get_for_model(model).id: model for model in (Expense, Household)}
+    for permissions in (UserObjectPermission, GroupObjectPermission):
+        after = state.get(permissions.__name__, 0)
+        rows = list(permissions.objects
+            .filter(id__gt=after, content_type__in=list(models))
+            .order_by('id')
+            .values_list('id', 'content_type', 'object_pk')[:size])
+        if not rows:
+            continue
+        object_ids = {}
+        for row_id, content_type, object_pk in rows:
+            object_ids.setdefault(content_type, set()).add(object_pk)
+        existing = {(content_type, str(pk)) for content_type, pks in object_ids.items()
+                    for pk in models[content_type].objects.filter(pk__in=pks).values_list('pk', flat=True)}
+        orphans = [row_id for row_id, content_type, object_pk in rows if (content_type, object_pk) not in existing]
+        permissions.objects.filter(id__in=orphans).delete()
+        state[permissions.__name__] = rows[-1][0]
+        state['removed'] = state.get('removed', 0) + len(orphans)
+        job.result = f"{state['removed']} orphaned permission(s) removed"
+        return False, len(rows)
+    return True, 0
+
+# one household per batch, or just the one in arguments
+def rebuild_household_balances(job, arguments, state):
+    if arguments.get('household_id'):
+        rebuild_balances(arguments['household_id'])
+        return True, 1
+    household_id = Household.objects.filter(id__gt=state.get('after', 0)).order_by('id').values_list('id', flat=True).first()
+    if household_id is None:
+        return True, 0
+    rebuild_balances(household_id)
+    state['after'] = household_id
+    return False, 1
+
+# streams the export into a temporary file and from there to the export storage, keeping its name in job.result
+# the name carries a random part, so it can't be guessed from the household and job ids
+def export_household(job, arguments, state):
+    household_id = arguments['household_id']
+    export_format = arguments.get('format', 'csv')
+    lines, content_type = EXPORT_FORMATS[export_format]
+    with tempfile.TemporaryFile() as output:
+        for line in lines(export_rows(household_id)):
+            output.write(line.encode())
+        output.seek(0)
+        name = f'household_{household_id}_{job.id}_{uuid.uuid4().hex}.{export_format}'
+        job.result = get_export_storage().save(name, output, content_type)
+    return True, 1
+
+# archives settled expenses a batch at a time until none are left
+def archive_expenses(job, arguments, state):
+    archived = archive_batch(arguments.get('household_id'), arguments.get('older_than_days'), batch_size())
+    return not archived, archived
+
+HANDLERS = {
+    Job.DELETE_HOUSEHOLD: delete_household,
+    Job.CLEANUP_PERMISSIONS: cleanup_permissions,
+    Job.REBUILD_BALANCES: rebuild_household_balances,
+    Job.EXPORT_HOUSEHOLD: export_household,
+    Job.ARCHIVE_EXPENSES: archive_expenses,
+}
+
+
+# takes the oldest runnable job, or one whose worker stopped reporting, with a conditional update so that
+# two workers can't claim the same job on databases without SELECT ... SKIP LOCKED
+def claim_job(worker):
+    now = timezone.now()
+    runnable = Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, locked_at__lt=now - lock_timeout())
+    for job in Job.objects.filter(runnable).order_by('run_after', 'id')[:10]:
+        claimed = (Job.objects
+            .filter(pk=job.pk, status=job.status, locked_at=job.locked_at)
+            .update(status=Job.RUNNING, locked_by=worker, locked_at=now))
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+# runs the job batch by batch, saving progress after each, until it's done or a batch fails
+def run_job(job, worker):
+    handler = HANDLERS[job.kind]
+    arguments = json.loads(job.arguments)
+    state = json.loads(job.state)
+    try:
+        while True:
+            with transaction.atomic():
+                done, processed = handler(job, arguments, state)
+                job.progress += processed
+                job.state = json.dumps(state)
+                job.locked_at = timezone.now()
+                if done:
+                    job.status = Job.DONE
+                    job.finished = timezone.now()
+                job.save()
+            if done:
+                return job
+            # another worker took the job over after our lock went stale
+            if not Job.objects.filter(pk=job.pk, locked_by=worker).exists():
+                return job
+    except Exception:
+        logger.exception('%s failed', job)
+        job.refresh_from_db()
+        job.attempts += 1
+        job.error = traceback.format_exc()
+        job.locked_by = ''
+        job.locked_at = None
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = Job.FAILED
+            job.finished = timezone.now()
+        job.save()
+        return job
+
+# runs every runnable job, returns how many it ran
+def run_pending(worker, limit=None):
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job(worker)
+        if job is None:
+            break
+        run_job(job, worker)
+        count += 1
+    return count
@@ -0,0 +1,80 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Balance, Household, LedgerEvent, LedgerSnapshot
+from .stream import broker
+
+# balance changes and snapshots are stored as json [debtor_id, creditor_id, "amount", open_splits] rows
+def encode_rows(rows):
+    return json.dumps([[debtor_id, creditor_id, str(amount), open_splits] for debtor_id, creditor_id, amount, open_splits in rows if debtor_id != creditor_id])
+
+def decode_rows(text):
+    return [(debtor_id, creditor_id, Decimal(amount), open_splits) for debtor_id, creditor_id, amount, open_splits in json.loads(text)]
+
+# appends an event for balance changes the caller has already applied, in the same transaction
+# every LEDGER_SNAPSHOT_INTERVAL events the household's balance table is copied into a snapshot
+# once the transaction commits, open streams for the household in this process are woken to send it
+def record_event(household_id, kind, changes=(), **fields):
+    with transaction.atomic(savepoint=False):
+        # the household row is locked until the transaction commits, so its events are numbered in commit order and
+        # a snapshot copies every event before its own; otherwise a lower numbered event committing later would be
+        # missing from the copy and skipped by every replay after it
+        list(Household.objects.select_for_update().filter(id=household_id).values_list('id'))
+        event = LedgerEvent.objects.create(household_id=household_id, kind=kind, changes=encode_rows(changes), **fields)
+        transaction.on_commit(lambda: broker.publish(household_id))
+        last_snapshot = LedgerSnapshot.objects.filter(household=household_id).order_by('-event').values('event')[:1]
+        since_snapshot = (LedgerEvent.objects
+            .filter(household=household_id, id__gt=Coalesce(Subquery(last_snapshot), 0))
+            .count())
+        if since_snapshot >= getattr(settings, 'LEDGER_SNAPSHOT_INTERVAL', 200):
+            take_snapshot(event)
+    return event
+
+# the balance table is kept in step with the events, so a snapshot is a copy of it
+def take_snapshot(event):
+    balances = (Balance.objects
+        .filter(household=event.household_id)
+        .exclude(amount=0, open_splits=0)
+        .values_list('debtor', 'creditor', 'amount', 'open_splits'))
+    return LedgerSnapshot.objects.create(household_id=event.household_id, event=event, balances=encode_rows(balances), date=event.date)
+
+# the household's balances as of an event or a moment, replayed from the nearest snapshot before it
+# returns {(debtor_id, creditor_id): (amount, open_splits)} for every pair with something open
+def balances_at(household_id, event_id=None, when=None):
+    events = LedgerEvent.objects.filter(household=household_id)
+    if event_id is not None:
+        events = events.filter(id__lte=event_id)
+    if when is not None:
+        events = events.filter(date__lte=when)
+    last_event_id = events.aggregate(last=Max('id'))['last']
+    if last_event_id is None:
+        return {}
+
+    balances = {}
+    snapshot = (LedgerSnapshot.objects
+        .filter(household=household_id, event__lte=last_event_id)
+        .order_by('-event')
+        .first())
+    if snapshot:
+        balances = {(debtor_id, creditor_id): (amount, open_splits) for debtor_id, creditor_id, amount, open_splits in decode_rows(snapshot.balances)}
+    replay = (LedgerEvent.objects
+        .filter(household=household_id, id__gt=snapshot.event_id if snapshot else 0, id__lte=last_event_id)
+        .order_by('id')
+        .values_list('changes', flat=True))
+    for changes in replay:
+        for debtor_id, creditor_id, amount, open_splits in decode_rows(changes):
+            total, count = balances.get((debtor_id, creditor_id), (0, 0))
+            balances[(debtor_id, creditor_id)] = (total + amount, count + open_splits)
+    return {pair: (amount, open_splits) for pair, (amount, open_splits) in balances.items() if amount or open_splits}
+
+# the household's most recent events, newest first
+def household_activity(household_id, limit=20):
+    return list(LedgerEvent.objects
+        .filter(household=household_id)
+        .select_related('actor', 'counterparty')
+        .order_by('-id')[:limit])
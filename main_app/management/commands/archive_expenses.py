@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_app.archive import archive_after_days, archive_batch
+from main_app.jobs import enqueue
+from main_app.models import Job
+
+
+class Command(BaseCommand):
+    help = ('Moves expenses whose splits are all paid, and that are older than ARCHIVE_AFTER_DAYS, '
+            'with their splits into the archive table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Only archive this household.')
+        parser.add_argument('--days', type=int, help='Archive settled expenses older than this many days instead.')
+        parser.add_argument('--batch', type=int, default=500, help='Expenses moved per transaction.')
+        parser.add_argument('--background', action='store_true', help='Queue an archive job for run_jobs instead.')
+
+    def handle(self, *args, **options):
+        household_id, days = options['household'], options['days']
+        if options['background']:
+            job = enqueue(Job.ARCHIVE_EXPENSES, household_id=household_id, older_than_days=days)
+            self.stdout.write(self.style.SUCCESS(f'Queued {job}.'))
+            return
+        total = 0
+        while True:
+            with transaction.atomic():
+                archived = archive_batch(household_id, days, options['batch'])
+            if not archived:
+                break
+            total += archived
+            self.stdout.write(f'archived {total} expense(s)')
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} settled expense(s) older than {archive_after_days() if days is None else days} days.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main_app.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the monthly spend rollups from the expenses and splits, or verifies them against them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Only backfill or verify this household.')
+        parser.add_argument('--verify', action='store_true', help='Compare the rollups to the expenses without changing them.')
+
+    def handle(self, *args, **options):
+        household_id = options['household']
+        if options['verify']:
+            mismatches = verify_rollups(household_id)
+            for household, member, month, stored, expected in mismatches:
+                self.stdout.write(f'household {household}: member {member} in {month:%Y-%m} stored {stored}, expected {expected}')
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} rollup(s) do not match the expenses.')
+            self.stdout.write(self.style.SUCCESS('Rollups match the expenses.'))
+        else:
+            with transaction.atomic():
+                count = rebuild_rollups(household_id)
+            self.stdout.write(self.style.SUCCESS(f'Backfilled {count} monthly rollup(s).'))
@@ -0,0 +1,99 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from main_app.archive import archive_batch
+from main_app.imports import batch_size
+from main_app.models import Expense, Household, Split
+
+
+class Command(BaseCommand):
+    help = ('Times an uncached household dashboard as its settled history grows, with the history in the live tables '
+            'and again after archiving it. Runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, nargs='+', default=[0, 10000, 50000, 100000], help='Settled expenses of history to time with.')
+        parser.add_argument('--open', type=int, default=200, help='Recent expenses with unpaid splits.')
+        parser.add_argument('--members', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per measurement.')
+        parser.add_argument('--output', default='bench_history.json', help='Where to write the machine-readable results.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        results = []
+        with transaction.atomic():
+            call_command('seed_households', households=1, members=options['members'], expenses=options['open'],
+                         settled_ratio=0.5, days=90, prefix='history', stdout=StringIO())
+            household = Household.objects.get(name='history household 0')
+            member_ids = list(household.members.order_by('id').values_list('id', flat=True))
+            client = Client()
+            client.force_login(household.members.get(pk=member_ids[0]))
+
+            history = 0
+            for size in sorted(options['history']):
+                self.add_history(rng, household, member_ids, size - history)
+                history = size
+                live = self.time_dashboard(client, household, options['repeat'])
+                live_splits = Split.objects.filter(expense__household=household).count()
+
+                # archive everything that qualifies, measure, then put the history back for the next size
+                savepoint = transaction.savepoint()
+                while archive_batch(household.id, size=2000):
+                    pass
+                archived = self.time_dashboard(client, household, options['repeat'])
+                archived_splits = Split.objects.filter(expense__household=household).count()
+                transaction.savepoint_rollback(savepoint)
+
+                results.append({'history': size, 'live_splits': live_splits, 'live_ms': live,
+                                'archived_splits': archived_splits, 'archived_ms': archived})
+                self.stdout.write(f'{size:>8} settled expenses: {live_splits:>7} splits live {live:>8.2f} ms, '
+                                  f'{archived_splits:>5} after archiving {archived:>8.2f} ms')
+            transaction.set_rollback(True)
+
+        with open(options['output'], 'w') as output:
+            json.dump({'database': connection.vendor, 'results': results}, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    # settled expenses from one to three years ago, every split paid
+    def add_history(self, rng, household, member_ids, count):
+        if count <= 0:
+            return
+        now = timezone.now()
+        expenses = [
+            Expense(household=household, member_id=rng.choice(member_ids), name=f'history {number}',
+                    cost=Decimal(rng.randint(100, 50000)) / 100, description='settled',
+                    date=now - timedelta(seconds=rng.randint(365 * 86400, 3 * 365 * 86400)))
+            for number in range(count)
+        ]
+        Expense.objects.bulk_create(expenses, batch_size=batch_size(Expense, expenses))
+        ids = Expense.objects.filter(household=household).order_by('-id').values_list('id', 'member')[:count]
+        splits = [Split(expense_id=expense_id, member_id=member_id, amount_owed=Decimal('1.00'), has_paid=True)
+                  for expense_id, payer_id in ids for member_id in member_ids if member_id != payer_id]
+        Split.objects.bulk_create(splits, batch_size=batch_size(Split, splits))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def time_dashboard(self, client, household, repeat):
+        url = reverse('households_details', args=[household.id])
+        timings = []
+        with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False):
+            for _ in range(repeat + 1):
+                # the dashboard is cached per household version, clearing it times the render after every write
+                cache.clear()
+                start = time.perf_counter()
+                client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings[1:])
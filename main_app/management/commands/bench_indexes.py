@@ -0,0 +1,101 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+
+from main_app.feeds import PAGE_SIZE, open_expenses
+from main_app.models import Balance, Expense, Household, Split
+
+# models whose Meta.indexes are dropped for the "before" run, the split uniqueness constraint stays in place
+TUNED_MODELS = [Expense, Split, Balance]
+
+
+class Command(BaseCommand):
+    help = ('Compares EXPLAIN plans and timings of the ledger queries with and without the tuned indexes. '
+            'The indexes are dropped for the "before" run and recreated afterwards, so run it against seeded data, '
+            'not a live database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Household to query, defaults to the one with the most expenses.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--plans', action='store_true', help='Print the full EXPLAIN output for every query.')
+
+    def handle(self, *args, **options):
+        households = Household.objects.all()
+        if options['household']:
+            households = households.filter(pk=options['household'])
+        household = households.annotate(expense_count=Count('expense')).order_by('-expense_count').first()
+        if household is None:
+            raise CommandError('No household to benchmark, run seed_households first.')
+        member = household.members.order_by('id').first()
+        if member is None:
+            raise CommandError(f'{household} has no members.')
+        self.stdout.write(f'{household}: {household.expense_count} expenses, '
+                          f'{Split.objects.filter(expense__household=household).count()} splits on {connection.vendor}')
+
+        queries = self.queries(household.id, member.id)
+        after = self.measure(queries, options['repeat'])
+        self.drop_indexes()
+        try:
+            before = self.measure(queries, options['repeat'])
+        finally:
+            self.create_indexes()
+
+        self.stdout.write(f"{'query':<20} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name in queries:
+            speedup = before[name]['median_ms'] / after[name]['median_ms'] if after[name]['median_ms'] else 0
+            self.stdout.write(f"{name:<20} {before[name]['median_ms']:>10.2f} {after[name]['median_ms']:>10.2f} {speedup:>7.1f}x")
+        for name in queries:
+            if options['plans']:
+                self.stdout.write(f'\n{name} before:\n{before[name]["plan"]}\n{name} after:\n{after[name]["plan"]}')
+            elif before[name]['plan'] == after[name]['plan']:
+                self.stdout.write(self.style.WARNING(f'{name}: the plan did not change'))
+
+    # the querysets behind the dashboard, the expense feed and the balance checks
+    def queries(self, household_id, member_id):
+        unpaid = Split.objects.filter(expense__household=household_id, has_paid=False)
+        return {
+            'expense feed': open_expenses(household_id)[:PAGE_SIZE + 1],
+            'open splits': (unpaid
+                .filter(Q(member=member_id) | Q(expense__member=member_id))
+                .select_related('member', 'expense__member')
+                .order_by('-expense__member', 'id')),
+            'owed to member': unpaid.filter(expense__member=member_id).values_list('member').annotate(total=Sum('amount_owed')).order_by(),
+            'owed by member': unpaid.filter(member=member_id).values_list('expense__member').annotate(total=Sum('amount_owed')).order_by(),
+            'expected balances': (unpaid
+                .exclude(member=F('expense__member'))
+                .values_list('member', 'expense__member')
+                .annotate(total=Sum('amount_owed'), count=Count('id'))
+                .order_by()),
+            'ledger': Balance.objects.filter(household=household_id, open_splits__gt=0).filter(Q(debtor=member_id) | Q(creditor=member_id)),
+        }
+
+    def measure(self, queries, repeat):
+        # fresh planner statistics, as a production database would have
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        results = {}
+        for name, queryset in queries.items():
+            # the first run warms the page cache so both sides are timed hot
+            list(queryset.all())
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {'plan': queryset.explain(), 'median_ms': statistics.median(timings)}
+        return results
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in TUNED_MODELS:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in TUNED_MODELS:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
@@ -0,0 +1,70 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Max, Min
+
+from main_app.models import Expense, Household
+from main_app.search import search_expenses, search_page
+
+
+class Command(BaseCommand):
+    help = ('Times the first page of expense searches against the current database for a member of its largest '
+            'household, from searches matching almost everything to ones matching nothing, and reports p50 and p95.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per search.')
+        parser.add_argument('--output', default='bench_search.json', help='Where to write the machine-readable results.')
+
+    def handle(self, *args, **options):
+        household = Household.objects.annotate(expense_count=Count('expense')).order_by('-expense_count').first()
+        if household is None or not household.expense_count:
+            raise CommandError('No expenses to search, run seed_households first.')
+        member = household.members.order_by('id').first()
+        household_ids = list(member.households.values_list('id', flat=True))
+        self.stdout.write(f'{Expense.objects.count()} expenses on {connection.vendor}, searching {len(household_ids)} '
+                          f'household(s) with {Expense.objects.filter(household__in=household_ids).count()} expenses')
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        results = []
+        for name, filters in self.searches(household, member).items():
+            timings = []
+            for _ in range(options['repeat'] + 1):
+                start = time.perf_counter()
+                page, after = search_page(search_expenses(household_ids, **filters))
+                timings.append((time.perf_counter() - start) * 1000)
+            timings = sorted(timings[1:])
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            results.append({'search': name, 'results': len(page), 'p50_ms': statistics.median(timings), 'p95_ms': p95})
+            self.stdout.write(f'{name:<24} {len(page):>3} results  p50 {statistics.median(timings):>8.2f} ms  p95 {p95:>8.2f} ms')
+
+        with open(options['output'], 'w') as output:
+            json.dump({'database': connection.vendor, 'results': results}, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    # filters from the search form, from broad to matching nothing, built from the household's own data
+    def searches(self, household, member):
+        expenses = Expense.objects.filter(household=household)
+        sample = expenses.order_by('id').values('name', 'cost', 'date')[expenses.count() // 2]
+        word = sample['name'].split()[-1]
+        dates = expenses.aggregate(first=Min('date'), last=Max('date'))
+        costs = expenses.aggregate(low=Min('cost'), high=Max('cost'))
+        month = sample['date'].date()
+        return {
+            'everything': {},
+            'common word': {'query': sample['name'].split()[0]},
+            'rare word': {'query': word},
+            'missing word': {'query': 'nosuchword'},
+            'member': {'member': member.id},
+            'one month': {'date_from': month, 'date_to': month + timedelta(days=30)},
+            'no dates match': {'date_from': dates['last'].date() + timedelta(days=1)},
+            'narrow cost': {'min_cost': sample['cost'], 'max_cost': sample['cost']},
+            'no costs match': {'min_cost': costs['high'] + Decimal('0.01')},
+            'word and filters': {'query': sample['name'].split()[0], 'member': member.id, 'date_from': dates['first'].date(),
+                                 'min_cost': costs['low']},
+        }
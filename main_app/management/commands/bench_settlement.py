@@ -0,0 +1,46 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from main_app.settlement import household_net_balances, plan_settlement
+
+
+class Command(BaseCommand):
+    help = 'Times the settlement planner on random households of increasing size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 1000, 5000, 20000], help='Member counts to plan for.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size; the best time is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--household', type=int, help='Also time loading and planning this household from the database.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'members':>8} {'transfers':>10} {'best ms':>10}")
+        for size in options['sizes']:
+            net = self.random_balances(rng, size)
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                transfers = plan_settlement(net)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f'{size:>8} {len(transfers):>10} {best * 1000:>10.2f}')
+
+        if options['household']:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                net = household_net_balances(options['household'])
+                transfers = plan_settlement(net)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(f"household {options['household']}: {len(net)} members with open balances, "
+                              f'{len(transfers)} transfers, {len(queries)} queries, {elapsed * 1000:.2f} ms')
+
+    # random cent amounts for every member but the last, who takes whatever makes the household sum to zero
+    def random_balances(self, rng, size):
+        net = {member_id: rng.randint(-50000, 50000) / 100 for member_id in range(size - 1)}
+        net[size - 1] = -sum(net.values())
+        return net
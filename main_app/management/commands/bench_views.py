@@ -0,0 +1,124 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from main_app.feeds import expense_page
+from main_app.models import Expense, Household
+
+
+class Command(BaseCommand):
+    help = ('Drives the household views through the test client against the configured database '
+            'and records wall time, query count and peak memory per view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Household to benchmark, defaults to the one with the most expenses.')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per view.')
+        parser.add_argument('--output', default='bench_results.json', help='Where to write the machine-readable results.')
+
+    def handle(self, *args, **options):
+        household = self.pick_household(options['household'])
+        member = household.members.order_by('id').first()
+        if member is None:
+            raise CommandError(f'{household} has no members.')
+        client = Client()
+        client.force_login(member)
+
+        results = []
+        with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False):
+            for name, method, url, data in self.scenarios(household, member):
+                results.append(self.measure(client, name, method, url, data, options['repeat']))
+
+        self.stdout.write(f"{'view':<22} {'queries':>8} {'median ms':>10} {'p95 ms':>8} {'peak KiB':>9}")
+        for result in results:
+            self.stdout.write(f"{result['view']:<22} {result['queries']:>8} {result['median_ms']:>10.2f} "
+                              f"{result['p95_ms']:>8.2f} {result['peak_kib']:>9.1f}")
+        report = {
+            'database': connection.vendor,
+            'household': household.id,
+            'expenses': Expense.objects.filter(household=household).count(),
+            'members': household.members.count(),
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    def pick_household(self, household_id):
+        households = Household.objects.all()
+        if household_id:
+            households = households.filter(pk=household_id)
+        household = households.annotate(expense_count=Count('expense')).order_by('-expense_count').first()
+        if household is None:
+            raise CommandError('No household to benchmark, run seed_households first.')
+        return household
+
+    # (url name, method, url, post data) for every route the benchmark drives
+    def scenarios(self, household, member):
+        first_page, cursor = expense_page(household.id)
+        expense = first_page[0] if first_page else Expense.objects.filter(household=household).first()
+        scenarios = [
+            ('households_index', 'get', reverse('households_index'), None),
+            ('households_details', 'get', reverse('households_details', args=[household.id]), None),
+            ('households_settle', 'get', reverse('households_settle', args=[household.id]), None),
+            ('households_stats', 'get', reverse('households_stats', args=[household.id]) + '?months=24', None),
+            ('households_export', 'get', reverse('households_export', args=[household.id]), None),
+            ('add_expense', 'post', reverse('add_expense', args=[household.id]), {'name': 'benchmark', 'cost': '12.34', 'description': 'benchmark'}),
+        ]
+        if cursor:
+            scenarios.append(('households_expenses', 'get', reverse('households_expenses', args=[household.id]) + f'?after={cursor}', None))
+        if expense:
+            scenarios.append(('expenses_search', 'get', reverse('expenses_search') + f'?q={expense.name}', None))
+            scenarios.append(('expenses_detail', 'get', reverse('expenses_detail', args=[household.id, expense.id]), None))
+        return scenarios
+
+    def request(self, client, method, url, data):
+        # writes are rolled back so repeated runs measure the same data
+        with transaction.atomic():
+            response = getattr(client, method)(url, data or {})
+            if response.streaming:
+                for chunk in response.streaming_content:
+                    pass
+            transaction.set_rollback(True)
+        return response
+
+    def measure(self, client, name, method, url, data, repeat):
+        # warm up caches and connections once before measuring
+        response = self.request(client, method, url, data)
+        if response.status_code >= 400:
+            raise CommandError(f'{name} returned {response.status_code}')
+
+        # each request clears the query log when it starts, so the capture has to start from an empty log
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, method, url, data)
+        # captured queries are read from the connection's log lazily, so count them before the next request clears it
+        query_count = len(queries)
+
+        tracemalloc.start()
+        self.request(client, method, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.request(client, method, url, data)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            'view': name,
+            'url': url,
+            'queries': query_count,
+            'median_ms': statistics.median(timings),
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            'min_ms': timings[0],
+            'peak_kib': peak / 1024,
+        }
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.exports import EXPORT_FORMATS
+from main_app.jobs import enqueue
+from main_app.models import Household, Job
+
+
+class Command(BaseCommand):
+    help = 'Queues a background job for the run_jobs worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=[kind for kind, label in Job.KIND_CHOICES])
+        parser.add_argument('--household', type=int, help='Household to delete, export or rebuild (rebuilds default to every household).')
+        parser.add_argument('--format', default='csv', choices=list(EXPORT_FORMATS), help='Export format.')
+
+    def handle(self, *args, **options):
+        kind, household_id = options['kind'], options['household']
+        arguments = {}
+        if household_id is not None:
+            if not Household.objects.filter(pk=household_id).exists():
+                raise CommandError(f'Household {household_id} does not exist.')
+            arguments['household_id'] = household_id
+        elif kind in (Job.DELETE_HOUSEHOLD, Job.EXPORT_HOUSEHOLD):
+            raise CommandError(f'{kind} needs --household.')
+        if kind == Job.EXPORT_HOUSEHOLD:
+            arguments['format'] = options['format']
+        job = enqueue(kind, **arguments)
+        self.stdout.write(self.style.SUCCESS(f'Queued {job}.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.imports import parse_expenses, import_expenses
+from main_app.models import Household, Member
+
+
+class Command(BaseCommand):
+    help = 'Imports expenses from a CSV file (name, cost, description, paid_by, date) into a household.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('household', type=int, help='Id of the household to import into.')
+        parser.add_argument('csv_path', help='Path to the CSV file.')
+        parser.add_argument('--user', required=True, help='Username recorded as the payer for rows without paid_by.')
+
+    def handle(self, *args, **options):
+        try:
+            household = Household.objects.get(pk=options['household'])
+            member = Member.objects.get(username=options['user'])
+        except (Household.DoesNotExist, Member.DoesNotExist) as error:
+            raise CommandError(error)
+
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8-sig') as csv_file:
+                expenses, errors = parse_expenses(household, csv_file, member)
+        except UnicodeDecodeError:
+            raise CommandError('The CSV file must be saved as UTF-8.')
+        if errors:
+            for line, message in errors:
+                self.stderr.write(f'line {line}: {message}')
+            raise CommandError(f'{len(errors)} invalid row(s), nothing was imported.')
+        count = import_expenses(household, expenses, member.id)
+        self.stdout.write(self.style.SUCCESS(f'Imported {count} expense(s) into {household.name}.'))
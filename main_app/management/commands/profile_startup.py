@@ -0,0 +1,90 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# runs in a fresh interpreter: loads the WSGI app, then serves the first and second requests through it
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from IoU2.wsgi import application
+loaded = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+def get(path):
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    statuses = []
+    b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    return statuses[0]
+status = get(sys.argv[1])
+first = time.perf_counter()
+get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({'status': status, 'load_ms': (loaded - start) * 1000, 'first_request_ms': (first - loaded) * 1000,
+                  'second_request_ms': (second - first) * 1000, 'total_ms': (first - start) * 1000}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measures cold start of IoU2.wsgi.application in fresh interpreters: import time per top-level package '
+            '(from python -X importtime), time to load the app and time to serve its first request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/', help='Path requested after the app loads.')
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts to time; medians are reported.')
+        parser.add_argument('--top', type=int, default=15, help='Packages to list by cumulative import time.')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        environ = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'IoU2.settings'))
+        runs = [self.probe(environ, options['path'], importtime=index == 0) for index in range(options['runs'])]
+        packages = runs[0].pop('imports')
+
+        self.stdout.write(f"{'package':<30} {'self ms':>9} {'cumulative ms':>14}")
+        for package, (own, cumulative) in sorted(packages.items(), key=lambda item: -item[1][1])[:options['top']]:
+            self.stdout.write(f'{package:<30} {own / 1000:>9.1f} {cumulative / 1000:>14.1f}')
+
+        # the first run pays for -X importtime's own overhead, so it's left out of the timings
+        timed = runs[1:] or runs
+        report = {key: statistics.median(run[key] for run in timed) for key in ('load_ms', 'first_request_ms', 'second_request_ms', 'total_ms')}
+        self.stdout.write(f"\nload {report['load_ms']:.1f} ms, first request {report['first_request_ms']:.1f} ms "
+                          f"(second {report['second_request_ms']:.1f} ms), time to first response {report['total_ms']:.1f} ms "
+                          f"over {len(timed)} cold starts, status {runs[0]['status']}")
+        if options['output']:
+            report['imports'] = {package: {'self_us': own, 'cumulative_us': cumulative} for package, (own, cumulative) in packages.items()}
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    def probe(self, environ, path, importtime):
+        command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE, path]
+        result = subprocess.run(command, env=environ, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f'The WSGI app failed to start:\n{result.stderr}')
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        if importtime:
+            run['imports'] = self.import_times(result.stderr)
+        return run
+
+    # rolls "import time: self [us] | cumulative | imported package" lines up to top-level packages
+    # a package's cumulative time counts each import of it that another package (or the app itself) triggered
+    def import_times(self, stderr):
+        packages = defaultdict(lambda: [0, 0])
+        lines = [line[len('import time:'):].split('|') for line in stderr.splitlines()
+                 if line.startswith('import time:') and 'self [us]' not in line]
+        # modules are printed after the imports they trigger, so walking backwards meets every parent before its children
+        ancestors = []
+        for own, cumulative, name in reversed(lines):
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            package = name.strip().split('.')[0]
+            del ancestors[depth:]
+            packages[package][0] += int(own)
+            if not ancestors or ancestors[-1] != package:
+                packages[package][1] += int(cumulative)
+            ancestors.append(package)
+        return packages
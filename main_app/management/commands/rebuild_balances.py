@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main_app.balances import rebuild_balances, verify_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the balance table from unpaid splits, or verifies it against them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Only rebuild or verify this household.')
+        parser.add_argument('--verify', action='store_true', help='Compare the balance table to the splits without changing it.')
+
+    def handle(self, *args, **options):
+        household_id = options['household']
+        if options['verify']:
+            mismatches = verify_balances(household_id)
+            for household, debtor, creditor, stored, expected in mismatches:
+                self.stdout.write(f'household {household}: member {debtor} -> member {creditor} stored {stored}, expected {expected}')
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} balance(s) do not match the splits.')
+            self.stdout.write(self.style.SUCCESS('Balances match the splits.'))
+        else:
+            with transaction.atomic():
+                count = rebuild_balances(household_id)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} balance(s).'))
@@ -0,0 +1,30 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main_app.jobs import run_pending
+from main_app.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (household deletes, permission cleanup, balance rebuilds, exports) as they arrive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit.')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait between checks for new jobs.')
+        parser.add_argument('--worker', default=f'{socket.gethostname()}:{os.getpid()}', help='Name recorded on the jobs this worker claims.')
+
+    def handle(self, *args, **options):
+        worker = options['worker']
+        while True:
+            count = run_pending(worker)
+            if count:
+                self.stdout.write(f'{worker}: ran {count} job(s), {Job.objects.filter(status=Job.FAILED).count()} failed in total')
+            if options['once']:
+                return
+            # a long-lived worker drops connections the database has timed out between checks
+            close_old_connections()
+            time.sleep(options['sleep'])
@@ -0,0 +1,74 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from guardian.shortcuts import assign_perm
+
+from main_app.balances import rebuild_balances
+from main_app.imports import batch_size, import_expenses
+from main_app.models import Expense, Household, Member, Split
+
+
+class Command(BaseCommand):
+    help = 'Seeds households, members, expenses and splits for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--households', type=int, default=10)
+        parser.add_argument('--members', type=int, default=5, help='Members per household.')
+        parser.add_argument('--expenses', type=int, default=1000, help='Expenses per household.')
+        parser.add_argument('--settled-ratio', type=float, default=0.8, help='Fraction of splits already paid.')
+        parser.add_argument('--days', type=int, default=730, help='Spread expense dates over this many past days.')
+        parser.add_argument('--prefix', default='seed', help='Prefix for generated usernames and household names.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        now = timezone.now()
+        for index in range(options['households']):
+            with transaction.atomic():
+                household = Household.objects.create(name=f'{prefix} household {index}')
+                members = self.create_members(household, [f'{prefix}_{index}_{number}' for number in range(options['members'])])
+                expenses = [
+                    Expense(household=household, member=rng.choice(members), name=f'expense {number}',
+                            cost=Decimal(rng.randint(100, 50000)) / 100, description='seeded',
+                            date=now - timedelta(seconds=rng.randint(0, options['days'] * 86400)))
+                    for number in range(options['expenses'])
+                ]
+                import_expenses(household, expenses)
+                split_ids = list(Split.objects.filter(expense__household=household).values_list('id', flat=True))
+                settled = rng.sample(split_ids, int(len(split_ids) * options['settled_ratio']))
+                for start in range(0, len(settled), 500):
+                    Split.objects.filter(id__in=settled[start:start + 500]).update(has_paid=True)
+                rebuild_balances(household.id)
+            self.stdout.write(f'{household.name}: {len(members)} members, {len(expenses)} expenses, '
+                              f'{len(split_ids)} splits ({len(settled)} settled)')
+
+    # members, groups and grants set up the same way HouseholdCreate and households_update would
+    def create_members(self, household, usernames):
+        members = [Member(username=username) for username in usernames]
+        for member in members:
+            member.set_unusable_password()
+        Member.objects.bulk_create(members, batch_size=batch_size(Member, members))
+        members = list(Member.objects.filter(username__in=usernames).order_by('id'))
+
+        household_group = Group.objects.create(name=f'household_{household.id}')
+        household_admins_group = Group.objects.create(name=f'household_{household.id}_admins')
+        assign_perm("view_household", household_group, household)
+        assign_perm("view_household", household_admins_group, household)
+        assign_perm("change_household", household_admins_group, household)
+        assign_perm("add_household", household_admins_group, household)
+        assign_perm("delete_household", household_admins_group, household)
+
+        Membership = Member.households.through
+        Membership.objects.bulk_create([Membership(member_id=member.id, household_id=household.id) for member in members])
+        GroupMembership = Member.groups.through
+        GroupMembership.objects.bulk_create(
+            [GroupMembership(member_id=member.id, group_id=household_group.id) for member in members] +
+            [GroupMembership(member_id=members[0].id, group_id=household_admins_group.id)]
+        )
+        return members
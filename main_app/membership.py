@@ -0,0 +1,61 @@
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.db.models import Q
+
+from .caching import bump_household_version
+from .models import Balance, Member
+
+HouseholdMembership = Member.households.through
+GroupMembership = Member.groups.through
+
+# member ids split into lists short enough for one statement each, sqlite takes at most 999 parameters
+# sized as if each id were bound twice next to the household's own, like members_with_open_balances does
+def member_batches(member_ids):
+    member_ids = sorted(member_ids)
+    size = max(connection.ops.bulk_batch_size(['household', 'debtor', 'creditor'], member_ids), 1)
+    return [member_ids[start:start + size] for start in range(0, len(member_ids), size)]
+
+# the m2m_changed receiver in caching.py stops QuerySet.delete() from running as a single statement on this table,
+# so the rows go in explicit DELETEs instead of being fetched and deleted one by one
+def delete_memberships(household_id, member_ids):
+    qn = connection.ops.quote_name
+    fields = HouseholdMembership._meta
+    with connection.cursor() as cursor:
+        for batch in member_batches(member_ids):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f"DELETE FROM {qn(fields.db_table)} WHERE {qn(fields.get_field('household').column)} = %s "
+                f"AND {qn(fields.get_field('member').column)} IN ({placeholders})",
+                [household_id, *batch])
+
+# (added, removed) member ids going from the household's current members to member_ids
+def membership_changes(household_id, member_ids):
+    current = set(HouseholdMembership.objects.filter(household=household_id).values_list('member', flat=True))
+    member_ids = set(member_ids)
+    return member_ids - current, current - member_ids
+
+# members among member_ids who still owe or are owed money in the household, in one query
+def members_with_open_balances(household_id, member_ids):
+    open_members = set()
+    for batch in member_batches(member_ids):
+        rows = (Balance.objects
+            .filter(household=household_id, open_splits__gt=0)
+            .filter(Q(debtor__in=batch) | Q(creditor__in=batch))
+            .values_list('debtor', 'creditor'))
+        open_members |= {member_id for pair in rows for member_id in pair}
+    return open_members & set(member_ids)
+
+# adds and removes members with bulk writes to the through tables, in the caller's transaction
+# added members join the read-only household group, removed members leave it and the admins group
+def apply_membership_changes(household_id, added, removed):
+    groups = dict(Group.objects.filter(name__in=[f'household_{household_id}', f'household_{household_id}_admins']).values_list('name', 'id'))
+    if removed:
+        delete_memberships(household_id, removed)
+        for batch in member_batches(removed):
+            GroupMembership.objects.filter(group__in=groups.values(), member__in=batch).delete()
+    if added:
+        HouseholdMembership.objects.bulk_create([HouseholdMembership(household_id=household_id, member_id=member_id) for member_id in added])
+        GroupMembership.objects.bulk_create([GroupMembership(group_id=groups[f'household_{household_id}'], member_id=member_id) for member_id in added])
+    # the bulk writes skip m2m_changed, so the dashboards are invalidated here
+    if added or removed:
+        bump_household_version(household_id)
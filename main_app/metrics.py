@@ -0,0 +1,118 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# literals are stripped so the same query with different parameters shares a fingerprint
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+def fingerprint(sql):
+    return IN_LISTS.sub('(?)', LITERALS.sub('?', sql))
+
+
+# counts the queries run while it is installed as an execute wrapper
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+# running totals per url name since the process started, exposed in the Prometheus text format
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(Counter)
+
+    def record(self, view, status, queries, duplicate_queries, db_seconds, seconds):
+        with self.lock:
+            totals = self.totals[view]
+            totals['requests'] += 1
+            totals[f'status_{status // 100}xx'] += 1
+            totals['queries'] += queries
+            totals['duplicate_queries'] += duplicate_queries
+            totals['db_seconds'] += db_seconds
+            totals['seconds'] += seconds
+            totals['max_queries'] = max(totals['max_queries'], queries)
+
+    def render(self):
+        lines = []
+        metrics = [
+            ('iou2_requests_total', 'counter', 'Requests handled.', 'requests'),
+            ('iou2_db_queries_total', 'counter', 'SQL queries run while handling requests.', 'queries'),
+            ('iou2_db_duplicate_queries_total', 'counter', 'Queries repeating a fingerprint already seen in the same request.', 'duplicate_queries'),
+            ('iou2_db_seconds_total', 'counter', 'Time spent in SQL queries.', 'db_seconds'),
+            ('iou2_request_seconds_total', 'counter', 'Wall time spent handling requests.', 'seconds'),
+            ('iou2_db_queries_max', 'gauge', 'Most SQL queries a single request has run.', 'max_queries'),
+        ]
+        with self.lock:
+            for name, kind, help_text, key in metrics:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for view, totals in sorted(self.totals.items()):
+                    lines.append(f'{name}{{view="{view}"}} {totals[key]}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+
+class QueryMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unresolved'
+        duplicates = recorder.duplicates()
+        duplicate_queries = sum(count - 1 for count in duplicates.values())
+        registry.record(view, response.status_code, recorder.count, duplicate_queries, recorder.duration, seconds)
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view)
+        log = logger.warning if budget is not None and recorder.count > budget else logger.info
+        log(json.dumps({
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'query_budget': budget,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'wall_ms': round(seconds * 1000, 2),
+            'duplicate_queries': duplicates,
+        }))
+        return response
+
+
+def metrics(request):
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1']):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
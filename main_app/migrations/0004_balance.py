@@ -0,0 +1,49 @@
+# Generated by Django 2.2.9 on 2026-10-18 10:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, F, Sum
+
+
+def populate_balances(apps, schema_editor):
+    Balance = apps.get_model('main_app', 'Balance')
+    Split = apps.get_model('main_app', 'Split')
+    rows = (Split.objects
+        .filter(has_paid=False)
+        .exclude(member=F('expense__member'))
+        .values_list('expense__household', 'member', 'expense__member')
+        .annotate(total=Sum('amount_owed'), count=Count('id'))
+        .order_by())
+    balances = [
+        Balance(household_id=household, debtor_id=debtor, creditor_id=creditor, amount=total, open_splits=count)
+        for household, debtor, creditor, total, count in rows
+    ]
+    # an explicit batch_size overrides the backend's limit on parameters per statement, so it's capped at that
+    batch_size = min(1000, schema_editor.connection.ops.bulk_batch_size(Balance._meta.concrete_fields, balances))
+    Balance.objects.bulk_create(balances, batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_auto_20200130_1640'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Balance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.FloatField(default=0)),
+                ('open_splits', models.PositiveIntegerField(default=0)),
+                ('creditor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to=settings.AUTH_USER_MODEL)),
+                ('debtor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debts', to=settings.AUTH_USER_MODEL)),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.Household')),
+            ],
+            options={
+                'unique_together': {('household', 'debtor', 'creditor')},
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.9 on 2026-10-18 10:29
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+# altering the columns keeps whatever float residue the old values had on sqlite, so they're rewritten in whole cents
+def round_to_cents(apps, schema_editor):
+    for model_name, field in [('Expense', 'cost'), ('Split', 'amount_owed')]:
+        model = apps.get_model('main_app', model_name)
+        rows = list(model.objects.exclude(**{field: None}).only('id', field))
+        for row in rows:
+            setattr(row, field, Decimal(getattr(row, field)).quantize(Decimal('0.01')))
+        model.objects.bulk_update(rows, [field], batch_size=1000)
+
+# splits were rounded to whole cents, so the running totals are rebuilt from them
+def rebuild_balances(apps, schema_editor):
+    Balance = apps.get_model('main_app', 'Balance')
+    Split = apps.get_model('main_app', 'Split')
+    Balance.objects.all().delete()
+    rows = (Split.objects
+        .filter(has_paid=False)
+        .exclude(member=F('expense__member'))
+        .values_list('expense__household', 'member', 'expense__member')
+        .annotate(total=Sum('amount_owed'), count=Count('id'))
+        .order_by())
+    balances = [
+        Balance(household_id=household, debtor_id=debtor, creditor_id=creditor, amount=total, open_splits=count)
+        for household, debtor, creditor, total, count in rows
+    ]
+    # an explicit batch_size overrides the backend's limit on parameters per statement, so it's capped at that
+    batch_size = min(1000, schema_editor.connection.ops.bulk_batch_size(Balance._meta.concrete_fields, balances))
+    Balance.objects.bulk_create(balances, batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_balance'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balance',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=2, default=None, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='split',
+            name='amount_owed',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.RunPython(round_to_cents, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.9 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0006_settlement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balance',
+            index=models.Index(fields=['household', 'creditor'], name='balance_household_creditor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['household', '-date', '-id'], name='expense_household_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['household', 'member'], name='expense_household_member_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='split',
+            index=models.Index(condition=models.Q(has_paid=False), fields=['expense', 'member', 'amount_owed'], name='split_unpaid_expense_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='split',
+            index=models.Index(condition=models.Q(has_paid=False), fields=['member', 'expense', 'amount_owed'], name='split_unpaid_member_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='split',
+            constraint=models.UniqueConstraint(fields=('expense', 'member'), name='split_expense_member_unique'),
+        ),
+    ]
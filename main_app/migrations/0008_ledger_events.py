@@ -0,0 +1,64 @@
+# Generated by Django 2.2.9 on 2026-10-18 10:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+from collections import defaultdict
+
+
+# every household starts its log with one event carrying its current balances, and a snapshot of them
+def open_ledgers(apps, schema_editor):
+    Balance = apps.get_model('main_app', 'Balance')
+    LedgerEvent = apps.get_model('main_app', 'LedgerEvent')
+    LedgerSnapshot = apps.get_model('main_app', 'LedgerSnapshot')
+    rows = defaultdict(list)
+    for household, debtor, creditor, amount, open_splits in Balance.objects.exclude(amount=0, open_splits=0).values_list('household', 'debtor', 'creditor', 'amount', 'open_splits'):
+        rows[household].append([debtor, creditor, str(amount), open_splits])
+    for household, balances in rows.items():
+        event = LedgerEvent.objects.create(household_id=household, kind='opened', changes=json.dumps(balances))
+        LedgerSnapshot.objects.create(household_id=household, event=event, balances=json.dumps(balances), date=event.date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0007_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opened', 'Opening balances'), ('expense_added', 'Expense added'), ('expense_edited', 'Expense edited'), ('expense_removed', 'Expense removed'), ('expenses_imported', 'Expenses imported'), ('split_settled', 'Split settled'), ('members_settled', 'Members settled up'), ('household_settled', 'Household settled up'), ('balances_rebuilt', 'Balances rebuilt')], max_length=20)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('changes', models.TextField(default='[]')),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('counterparty', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('expense', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='main_app.Expense')),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.Household')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balances', models.TextField()),
+                ('date', models.DateTimeField()),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.LedgerEvent')),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.Household')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgersnapshot',
+            index=models.Index(fields=['household', 'event'], name='ledgersnapshot_household_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerevent',
+            index=models.Index(fields=['household', 'id'], name='ledgerevent_household_idx'),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.9 on 2026-10-18 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def month_of(moment):
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date().replace(day=1)
+
+def populate_rollups(apps, schema_editor):
+    Expense = apps.get_model('main_app', 'Expense')
+    Split = apps.get_model('main_app', 'Split')
+    MonthlySpend = apps.get_model('main_app', 'MonthlySpend')
+    totals = defaultdict(lambda: [0, 0, 0, 0])
+    paid = Expense.objects.annotate(month=TruncMonth('date')).values_list('household', 'member', 'month').annotate(total=Sum('cost'), count=Count('id')).order_by()
+    for household, member, month, total, count in paid:
+        totals[(household, member, month_of(month))][0] += Decimal(total).quantize(Decimal('0.01'))
+        totals[(household, member, month_of(month))][3] += count
+    splits = Split.objects.exclude(member=F('expense__member')).annotate(month=TruncMonth('expense__date'))
+    for household, member, month, total in splits.values_list('expense__household', 'expense__member', 'month').annotate(total=Sum('amount_owed')).order_by():
+        totals[(household, member, month_of(month))][1] += Decimal(total).quantize(Decimal('0.01'))
+    for household, member, month, total in splits.values_list('expense__household', 'member', 'month').annotate(total=Sum('amount_owed')).order_by():
+        totals[(household, member, month_of(month))][2] += Decimal(total).quantize(Decimal('0.01'))
+    MonthlySpend.objects.bulk_create([
+        MonthlySpend(household_id=household, member_id=member, month=month, paid=paid, lent=lent, owed=owed, expenses=expenses)
+        for (household, member, month), (paid, lent, owed, expenses) in totals.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0008_ledger_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySpend',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('lent', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('expenses', models.PositiveIntegerField(default=0)),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.Household')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('household', 'month', 'member')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
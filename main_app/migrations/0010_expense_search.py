@@ -0,0 +1,57 @@
+# Generated by Django 2.2.9 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+# postgres searches the expense table through GIN indexes, other databases fill the SearchTerm table
+def index_expenses(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    Expense = apps.get_model('main_app', 'Expense')
+    SearchTerm = apps.get_model('main_app', 'SearchTerm')
+    words = re.compile(r'\w+')
+    rows = []
+    for expense_id, household_id, name, description in Expense.objects.values_list('id', 'household', 'name', 'description').iterator():
+        rows += [SearchTerm(term=term, expense_id=expense_id, household_id=household_id)
+                 for term in {word[:40] for word in words.findall(f'{name} {description}'.lower())}]
+        if len(rows) >= 10000:
+            SearchTerm.objects.bulk_create(rows)
+            rows = []
+    SearchTerm.objects.bulk_create(rows)
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'CREATE INDEX expense_search_idx ON main_app_expense USING gin ({DOCUMENT})')
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS expense_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0009_monthly_spend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=40)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main_app.Expense')),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main_app.Household')),
+            ],
+            options={
+                'unique_together': {('term', 'household', 'expense')},
+            },
+        ),
+        migrations.RunPython(index_expenses, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
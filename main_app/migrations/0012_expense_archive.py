@@ -0,0 +1,38 @@
+# Generated by Django 2.2.9 on 2026-10-18 11:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('delete_household', 'Delete household'), ('cleanup_permissions', 'Clean up orphaned permissions'), ('rebuild_balances', 'Rebuild balances'), ('export_household', 'Export household'), ('archive_expenses', 'Archive settled expenses')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='ArchivedExpense',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('date', models.DateTimeField()),
+                ('description', models.CharField(max_length=100)),
+                ('splits', models.TextField(default='[]')),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.Household')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedexpense',
+            index=models.Index(fields=['household', 'id'], name='archivedexpense_household_idx'),
+        ),
+    ]
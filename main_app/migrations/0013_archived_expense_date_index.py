@@ -0,0 +1,17 @@
+# Generated by Django 2.2.9 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_expense_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedexpense',
+            index=models.Index(fields=['household', '-date', '-id'], name='archivedexpense_date_idx'),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from datetime import datetime
+from django.utils import timezone
 from django.urls import reverse
 
 class Household(models.Model):
@@ -26,10 +27,18 @@ class Expense(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     household = models.ForeignKey(Household, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
-    cost = models.FloatField(blank=True, default=None)
+    cost = models.DecimalField(max_digits=10, decimal_places=2, blank=True, default=None)
     date = models.DateTimeField(default=datetime.now, blank=True)
     description = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            # the expense feed pages through a household newest first
+            models.Index(fields=['household', '-date', '-id'], name='expense_household_date_idx'),
+            # ledger aggregates join splits to the expenses each member paid for
+            models.Index(fields=['household', 'member'], name='expense_household_member_idx'),
+        ]
+
     def __str__(self):
         return f"{self.member.username} added {self.name} for {self.cost}"
 
@@ -41,7 +50,232 @@ class Split(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE)
     has_paid = models.BooleanField(default=False)
-    amount_owed = models.FloatField()
+    amount_owed = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'member'], name='split_expense_member_unique'),
+        ]
+        # unpaid splits are a small, shrinking share of the table, so the hot queries use partial indexes that
+        # only cover them, with amount_owed last so totals can be summed from the index alone
+        indexes = [
+            models.Index(fields=['expense', 'member', 'amount_owed'], name='split_unpaid_expense_idx', condition=models.Q(has_paid=False)),
+            models.Index(fields=['member', 'expense', 'amount_owed'], name='split_unpaid_member_idx', condition=models.Q(has_paid=False)),
+        ]
 
     def __str__(self):
         return f"{self.member.username} owes {self.expense.member} ${self.amount_owed} for {self.expense.name}."
+
+class Balance(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    debtor = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="debts")
+    creditor = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="credits")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    open_splits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('household', 'debtor', 'creditor')
+        # the unique index above covers lookups by debtor, ledgers also look members up as creditors
+        indexes = [
+            models.Index(fields=['household', 'creditor'], name='balance_household_creditor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.debtor.username} owes {self.creditor.username} ${self.amount} in {self.household.name}."
+
+class Settlement(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    payer = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="payments_made")
+    payee = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="payments_received")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    splits_settled = models.PositiveIntegerField()
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.payer.username} paid {self.payee.username} ${self.amount} in {self.household.name}."
+
+# spend per household member and calendar month, kept in step with the expense write paths
+# paid is what the member paid for, lent the shares of that others owe them and owed their shares of others' expenses,
+# so paid - lent + owed is the member's own share of the month's spending
+class MonthlySpend(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    month = models.DateField()
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    lent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    expenses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('household', 'month', 'member')
+
+    @property
+    def share(self):
+        return self.paid - self.lent + self.owed
+
+    def __str__(self):
+        return f"{self.member.username} paid ${self.paid} in {self.household.name} in {self.month:%B %Y}."
+
+# append-only record of every change to a household's balances, newest last
+# `changes` holds the balance deltas the event applied as json [debtor_id, creditor_id, "amount", open_splits] rows,
+# so replaying a household's events from a snapshot rebuilds its balance table at any point in time
+class LedgerEvent(models.Model):
+    OPENED = 'opened'
+    EXPENSE_ADDED = 'expense_added'
+    EXPENSE_EDITED = 'expense_edited'
+    EXPENSE_REMOVED = 'expense_removed'
+    EXPENSES_IMPORTED = 'expenses_imported'
+    SPLIT_SETTLED = 'split_settled'
+    MEMBERS_SETTLED = 'members_settled'
+    HOUSEHOLD_SETTLED = 'household_settled'
+    BALANCES_REBUILT = 'balances_rebuilt'
+    KIND_CHOICES = [
+        (OPENED, 'Opening balances'),
+        (EXPENSE_ADDED, 'Expense added'),
+        (EXPENSE_EDITED, 'Expense edited'),
+        (EXPENSE_REMOVED, 'Expense removed'),
+        (EXPENSES_IMPORTED, 'Expenses imported'),
+        (SPLIT_SETTLED, 'Split settled'),
+        (MEMBERS_SETTLED, 'Members settled up'),
+        (HOUSEHOLD_SETTLED, 'Household settled up'),
+        (BALANCES_REBUILT, 'Balances rebuilt'),
+    ]
+    DESCRIPTIONS = {
+        OPENED: "Balances from before the activity log started were carried over.",
+        EXPENSE_ADDED: "{actor} added {name} for ${amount}.",
+        EXPENSE_EDITED: "{actor} changed {name} to ${amount}.",
+        EXPENSE_REMOVED: "{actor} removed {name} (${amount}).",
+        EXPENSES_IMPORTED: "{actor} imported {name} totalling ${amount}.",
+        SPLIT_SETTLED: "{actor} marked {counterparty}'s ${amount} share of {name} paid.",
+        MEMBERS_SETTLED: "{actor} settled up ${amount} with {counterparty}.",
+        HOUSEHOLD_SETTLED: "{actor} settled up the whole household.",
+        BALANCES_REBUILT: "Balances were recalculated from the expenses.",
+    }
+
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    actor = models.ForeignKey(Member, null=True, on_delete=models.SET_NULL, related_name="+")
+    counterparty = models.ForeignKey(Member, null=True, on_delete=models.SET_NULL, related_name="+")
+    # removed expenses keep their events, so this is a plain reference without a database constraint
+    expense = models.ForeignKey(Expense, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="events")
+    name = models.CharField(max_length=100, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    changes = models.TextField(default='[]')
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'id'], name='ledgerevent_household_idx'),
+        ]
+
+    def __str__(self):
+        return self.DESCRIPTIONS[self.kind].format(
+            actor=self.actor.username if self.actor else 'Someone',
+            counterparty=self.counterparty.username if self.counterparty else 'someone',
+            name=self.name,
+            amount=self.amount,
+        )
+
+# the household's whole balance table as of `event`, as json [debtor_id, creditor_id, "amount", open_splits] rows
+class LedgerSnapshot(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    event = models.ForeignKey(LedgerEvent, on_delete=models.CASCADE)
+    balances = models.TextField()
+    date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'event'], name='ledgersnapshot_household_idx'),
+        ]
+
+    def __str__(self):
+        return f"Balances in {self.household.name} as of event {self.event_id}."
+
+# inverted index of the words in expense names and descriptions, for databases without full text search
+# (on postgres search uses the GIN indexes from migration 0010 instead and this table stays empty)
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=40)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="+")
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        # covers the household scoped term lookups, expense ids are read straight from the index
+        unique_together = ('term', 'household', 'expense')
+
+    def __str__(self):
+        return f"{self.term} in expense {self.expense_id}"
+
+# an expense whose splits were all paid long enough ago, moved out of the expense and split tables by main_app/archive.py
+# it keeps the expense's id, and its splits (all paid) as json [split_id, member_id, "amount_owed"] rows
+class ArchivedExpense(models.Model):
+    id = models.IntegerField(primary_key=True)
+    household = models.ForeignKey(Household, on_delete=models.CASCADE)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    cost = models.DecimalField(max_digits=10, decimal_places=2)
+    date = models.DateTimeField()
+    description = models.CharField(max_length=100)
+    splits = models.TextField(default='[]')
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # exports read a household's archive in id order, the api pages through it newest first
+        indexes = [
+            models.Index(fields=['household', 'id'], name='archivedexpense_household_idx'),
+            models.Index(fields=['household', '-date', '-id'], name='archivedexpense_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.member.username} added {self.name} for {self.cost}"
+
+# background work that shouldn't hold up a web request, picked up by `manage.py run_jobs` (see main_app/jobs.py)
+# arguments and state are json, state is where a job keeps its place between batches
+class Job(models.Model):
+    DELETE_HOUSEHOLD = 'delete_household'
+    CLEANUP_PERMISSIONS = 'cleanup_permissions'
+    REBUILD_BALANCES = 'rebuild_balances'
+    EXPORT_HOUSEHOLD = 'export_household'
+    ARCHIVE_EXPENSES = 'archive_expenses'
+    KIND_CHOICES = [
+        (DELETE_HOUSEHOLD, 'Delete household'),
+        (CLEANUP_PERMISSIONS, 'Clean up orphaned permissions'),
+        (REBUILD_BALANCES, 'Rebuild balances'),
+        (EXPORT_HOUSEHOLD, 'Export household'),
+        (ARCHIVE_EXPENSES, 'Archive settled expenses'),
+    ]
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    arguments = models.TextField(default='{}')
+    state = models.TextField(default='{}')
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    result = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    requested_by = models.ForeignKey(Member, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # workers look for the oldest runnable job in a status
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.id} ({self.status})"
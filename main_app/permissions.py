@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import SimpleLazyObject, empty
+from guardian.core import ObjectPermissionChecker
+
+from .models import Household
+
+
+# object permission checks for a single request
+# the first household check loads the user's grants for every household they belong to, so later checks are free
+class RequestPermissions:
+    def __init__(self, user):
+        self.user = user
+        self.checker = ObjectPermissionChecker(user) if user.is_authenticated else None
+        # number of database queries spent on permission checks during the request
+        self.queries = 0
+        self._households_prefetched = False
+        # cache keys of the objects whose grants have been loaded already
+        self._prefetched = set()
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    # loads grants for many objects of the same model at once, e.g. every expense a page renders
+    def prefetch(self, objects):
+        if self.checker is None:
+            return
+        objects = [obj for obj in objects if self.checker.get_local_cache_key(obj) not in self._prefetched]
+        self._prefetched.update(self.checker.get_local_cache_key(obj) for obj in objects)
+        if objects:
+            with connection.execute_wrapper(self._count_query):
+                self.checker.prefetch_perms(objects)
+
+    def has_perm(self, perm, obj):
+        if self.checker is None:
+            return False
+        if isinstance(obj, Household) and not self._households_prefetched:
+            self._households_prefetched = True
+            with connection.execute_wrapper(self._count_query):
+                households = list(self.user.households.all())
+            self.prefetch(households + [obj])
+        with connection.execute_wrapper(self._count_query):
+            return self.checker.has_perm(perm, obj)
+
+
+class PermissionCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.perms = SimpleLazyObject(lambda: RequestPermissions(request.user))
+        response = self.get_response(request)
+        if settings.DEBUG and request.perms._wrapped is not empty:
+            response['X-Permission-Queries'] = str(request.perms.queries)
+        return response
@@ -0,0 +1,154 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .balances import CENT
+from .archive import archived_splits
+from .models import ArchivedExpense, Expense, MonthlySpend, Split
+
+ZERO = Decimal('0.00')
+
+# first day of the expense's month in the site's time zone
+def month_of(moment):
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date().replace(day=1)
+
+# (member_id, month, paid, lent, owed, expenses) deltas for adding an expense, or removing it with sign=-1
+# shares are (member_id, amount_owed) for each of the expense's splits
+def expense_rollup_changes(payer_id, when, cost, shares, sign=1):
+    month = month_of(when)
+    lent = sum(amount for member_id, amount in shares if member_id != payer_id)
+    changes = [(payer_id, month, sign * cost, sign * lent, 0, sign)]
+    changes += [(member_id, month, 0, 0, sign * amount, 0) for member_id, amount in shares if member_id != payer_id]
+    return changes
+
+# applies rollup deltas to the household's monthly rows, in the caller's transaction
+def apply_rollup_changes(household_id, changes):
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for member_id, month, paid, lent, owed, expenses in changes:
+        delta = deltas[(member_id, month)]
+        delta[0] += paid
+        delta[1] += lent
+        delta[2] += owed
+        delta[3] += expenses
+    if not deltas:
+        return
+
+    existing = (MonthlySpend.objects
+        .select_for_update()
+        .filter(household=household_id, month__in={month for member_id, month in deltas}, member__in={member_id for member_id, month in deltas}))
+    updated = []
+    for row in existing:
+        key = (row.member_id, row.month)
+        if key in deltas:
+            paid, lent, owed, expenses = deltas.pop(key)
+            row.paid += paid
+            row.lent += lent
+            row.owed += owed
+            row.expenses += expenses
+            updated.append(row)
+    if updated:
+        MonthlySpend.objects.bulk_update(updated, ['paid', 'lent', 'owed', 'expenses'])
+    if deltas:
+        MonthlySpend.objects.bulk_create([
+            MonthlySpend(household_id=household_id, member_id=member_id, month=month, paid=paid, lent=lent, owed=owed, expenses=expenses)
+            for (member_id, month), (paid, lent, owed, expenses) in deltas.items()
+        ])
+
+# monthly totals per (household, member, month), straight from the expense and split tables
+# returns {(household_id, member_id, month): (paid, lent, owed, expenses)}
+def expected_rollups(household_id=None):
+    expenses = Expense.objects.all()
+    splits = Split.objects.exclude(member=F('expense__member'))
+    if household_id is not None:
+        expenses = expenses.filter(household=household_id)
+        splits = splits.filter(expense__household=household_id)
+    totals = defaultdict(lambda: [ZERO, ZERO, ZERO, 0])
+    # sqlite sums decimals as floats, so totals are rounded back to whole cents
+    paid = (expenses
+        .annotate(month=TruncMonth('date'))
+        .values_list('household', 'member', 'month')
+        .annotate(total=Sum('cost'), count=Count('id'))
+        .order_by())
+    for household, member, month, total, count in paid:
+        totals[(household, member, month_of(month))][0] += Decimal(total).quantize(CENT)
+        totals[(household, member, month_of(month))][3] += count
+    lent = (splits
+        .annotate(month=TruncMonth('expense__date'))
+        .values_list('expense__household', 'expense__member', 'month')
+        .annotate(total=Sum('amount_owed'))
+        .order_by())
+    for household, member, month, total in lent:
+        totals[(household, member, month_of(month))][1] += Decimal(total).quantize(CENT)
+    owed = (splits
+        .annotate(month=TruncMonth('expense__date'))
+        .values_list('expense__household', 'member', 'month')
+        .annotate(total=Sum('amount_owed'))
+        .order_by())
+    for household, member, month, total in owed:
+        totals[(household, member, month_of(month))][2] += Decimal(total).quantize(CENT)
+    # archived expenses still count towards their month
+    archived = ArchivedExpense.objects.all() if household_id is None else ArchivedExpense.objects.filter(household=household_id)
+    for expense in archived.iterator():
+        for member, month, paid, lent, owed, count in expense_rollup_changes(expense.member_id, expense.date, expense.cost,
+                                                                             [(member_id, amount) for split_id, member_id, amount in archived_splits(expense)]):
+            row = totals[(expense.household_id, member, month)]
+            row[0] += paid
+            row[1] += lent
+            row[2] += owed
+            row[3] += count
+    return {key: tuple(row) for key, row in totals.items()}
+
+def rebuild_rollups(household_id=None):
+    rollups = MonthlySpend.objects.all()
+    if household_id is not None:
+        rollups = rollups.filter(household=household_id)
+    rollups.delete()
+    rows = [
+        MonthlySpend(household_id=household, member_id=member, month=month, paid=paid, lent=lent, owed=owed, expenses=expenses)
+        for (household, member, month), (paid, lent, owed, expenses) in expected_rollups(household_id).items()
+    ]
+    MonthlySpend.objects.bulk_create(rows)
+    return len(rows)
+
+# returns (household_id, member_id, month, stored, expected) for every row that disagrees with the expenses
+def verify_rollups(household_id=None):
+    expected = expected_rollups(household_id)
+    rollups = MonthlySpend.objects.all()
+    if household_id is not None:
+        rollups = rollups.filter(household=household_id)
+    mismatches = []
+    for household, member, month, paid, lent, owed, expenses in rollups.values_list('household', 'member', 'month', 'paid', 'lent', 'owed', 'expenses'):
+        stored = (paid, lent, owed, expenses)
+        totals = expected.pop((household, member, month), (ZERO, ZERO, ZERO, 0))
+        if stored != totals:
+            mismatches.append((household, member, month, stored, totals))
+    for (household, member, month), totals in expected.items():
+        if totals != (ZERO, ZERO, ZERO, 0):
+            mismatches.append((household, member, month, (ZERO, ZERO, ZERO, 0), totals))
+    return mismatches
+
+# the last `months` calendar months up to and including this one, oldest first
+def recent_months(months, today=None):
+    month = month_of(today or timezone.now())
+    result = [month]
+    for _ in range(months - 1):
+        month = (month - timedelta(days=1)).replace(day=1)
+        result.append(month)
+    return result[::-1]
+
+# one household's rollup rows for the given months, as {month: [MonthlySpend]}
+def monthly_spend(household_id, months):
+    rows = (MonthlySpend.objects
+        .filter(household=household_id, month__gte=months[0], month__lte=months[-1])
+        .select_related('member')
+        .order_by('month', 'member__username'))
+    by_month = {month: [] for month in months}
+    for row in rows:
+        by_month[row.month].append(row)
+    return by_month
@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+# set for the length of a request that's allowed to read from the replica
+_state = threading.local()
+
+STICKY_SESSION_KEY = 'primary_until'
+
+# the replica's alias, or None when reads all go to the primary
+def replica_alias():
+    return getattr(settings, 'DATABASE_REPLICA', None)
+
+# after a request writes, that session reads from the primary for this many seconds so it sees its own writes
+# even while the replica is catching up
+def sticky_seconds():
+    return getattr(settings, 'PRIMARY_STICKY_SECONDS', 10)
+
+def reading_from_replica():
+    # reads inside a transaction on the primary stay there, they may depend on its uncommitted writes
+    return (bool(replica_alias()) and getattr(_state, 'replica', False)
+            and not connections['default'].in_atomic_block)
+
+@contextmanager
+def use_replica():
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+# data read from a replica may be behind the household version it gets cached under,
+# so it only stays cached for as long as a replica is allowed to lag
+def cache_timeout(timeout):
+    return min(timeout, sticky_seconds()) if reading_from_replica() else timeout
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            return replica_alias()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    # the replica holds the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def replica_stream(content):
+    with use_replica():
+        yield from content
+
+
+# notes whether the request wrote anything to the primary
+class WriteDetector:
+    def __init__(self):
+        self.wrote = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+# sends GET requests for the views in REPLICA_VIEWS to the replica, unless the session wrote something
+# within the last PRIMARY_STICKY_SECONDS; has to come after the session middleware
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_alias():
+            return self.get_response(request)
+
+        writes = WriteDetector()
+        with connections['default'].execute_wrapper(writes):
+            if self.replica_safe(request):
+                with use_replica():
+                    response = self.get_response(request)
+                # streamed responses like exports read as they're sent, after the view has returned
+                if response.streaming:
+                    response.streaming_content = replica_stream(response.streaming_content)
+            else:
+                response = self.get_response(request)
+        if writes.wrote:
+            request.session[STICKY_SESSION_KEY] = time.time() + sticky_seconds()
+        return response
+
+    def replica_safe(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if request.session.get(STICKY_SESSION_KEY, 0) > time.time():
+            return False
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return False
+        return url_name in getattr(settings, 'REPLICA_VIEWS', ())
@@ -0,0 +1,78 @@
+import re
+from datetime import date, datetime, time, timedelta
+
+from django.db import connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Expense, SearchTerm
+
+PAGE_SIZE = 20
+WORDS = re.compile(r'\w+')
+MAX_TERM_LENGTH = 40
+
+# postgres searches the expense columns through the GIN index from migration 0010, this has to match its expression
+DOCUMENT = "to_tsvector('simple', coalesce(main_app_expense.name, '') || ' ' || coalesce(main_app_expense.description, ''))"
+
+def terms(text):
+    return {word[:MAX_TERM_LENGTH] for word in WORDS.findall(text.lower())}
+
+def full_text_search():
+    return connection.vendor == 'postgresql'
+
+# keeps the inverted index in step with the expenses, pass new=True to skip clearing old terms for freshly inserted ones
+def index_expenses(expenses, new=False):
+    if full_text_search() or not expenses:
+        return
+    if not new:
+        SearchTerm.objects.filter(expense__in=[expense.id for expense in expenses]).delete()
+    SearchTerm.objects.bulk_create([
+        SearchTerm(term=term, expense_id=expense.id, household_id=expense.household_id)
+        for expense in expenses
+        for term in terms(f'{expense.name} {expense.description}')
+    ])
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, created, **kwargs):
+    index_expenses([instance], new=created)
+
+
+# the first moment of a day in the current time zone
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+# expenses in the given households matching every word of the query and the filters, most recently added first
+# postgres also matches words by prefix, the inverted index only matches whole words
+def search_expenses(household_ids, query='', member=None, date_from=None, date_to=None, min_cost=None, max_cost=None):
+    expenses = Expense.objects.filter(household__in=household_ids)
+    words = sorted(terms(query))
+    if words and full_text_search():
+        expenses = expenses.extra(where=[f"{DOCUMENT} @@ to_tsquery('simple', %s)"], params=[' & '.join(f'{word}:*' for word in words)])
+    elif words:
+        # each word is a range scan of the (term, expense) index, narrowed to the same households
+        for word in words:
+            expenses = expenses.filter(id__in=SearchTerm.objects.filter(term=word, household__in=household_ids).values('expense'))
+    if member is not None:
+        expenses = expenses.filter(member=member)
+    # dates are compared as datetime bounds on the bare column, so the (household, date) index can serve the range
+    if date_from is not None:
+        expenses = expenses.filter(date__gte=start_of_day(date_from))
+    # the last day a date can hold has no day after it to bound by, and nothing falls after it anyway
+    if date_to is not None and date_to < date.max:
+        expenses = expenses.filter(date__lt=start_of_day(date_to + timedelta(days=1)))
+    if min_cost is not None:
+        expenses = expenses.filter(cost__gte=min_cost)
+    if max_cost is not None:
+        expenses = expenses.filter(cost__lte=max_cost)
+    return expenses.select_related('member', 'household').order_by('-id')
+
+# one page of results after the expense id in `after`, and the id to continue from (None on the last page)
+def search_page(expenses, after=None, page_size=PAGE_SIZE):
+    if after:
+        expenses = expenses.filter(id__lt=after)
+    page = list(expenses[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, page[-1].id
+    return page, None
@@ -0,0 +1,81 @@
+import heapq
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+
+from .caching import bump_household_version
+from .ledger import record_event
+from .models import Balance, LedgerEvent, Settlement, Split
+
+# net position of every member with open debts in the household: positive if they are owed money, negative if they owe
+def household_net_balances(household_id):
+    net = {}
+    balances = Balance.objects.filter(household=household_id, open_splits__gt=0).values_list('debtor', 'creditor', 'amount')
+    for debtor_id, creditor_id, amount in balances:
+        net[debtor_id] = net.get(debtor_id, 0) - amount
+        net[creditor_id] = net.get(creditor_id, 0) + amount
+    return net
+
+# greedily pairs the largest debtor with the largest creditor until everyone is square
+# returns (debtor_id, creditor_id, amount) transfers, at most one fewer than the number of members with a non-zero balance
+def plan_settlement(net_balances):
+    creditors = []
+    debtors = []
+    for member_id, amount in net_balances.items():
+        cents = round(amount * 100)
+        if cents > 0:
+            creditors.append((-cents, member_id))
+        elif cents < 0:
+            debtors.append((cents, member_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        cents = min(-credit, -debt)
+        transfers.append((debtor_id, creditor_id, Decimal(cents) / 100))
+        if -credit > cents:
+            heapq.heappush(creditors, (credit + cents, creditor_id))
+        if -debt > cents:
+            heapq.heappush(debtors, (debt + cents, debtor_id))
+    return transfers
+
+# once the planned transfers are made every open split in the household is paid off
+def settle_household(household_id, actor_id=None):
+    with transaction.atomic():
+        balances = list(Balance.objects
+            .select_for_update()
+            .filter(household=household_id, open_splits__gt=0)
+            .values_list('debtor', 'creditor', 'amount', 'open_splits'))
+        settled = Split.objects.filter(expense__household=household_id, has_paid=False).update(has_paid=True)
+        Balance.objects.filter(household=household_id).update(amount=0, open_splits=0)
+        record_event(household_id, LedgerEvent.HOUSEHOLD_SETTLED, [(debtor_id, creditor_id, -amount, -open_splits) for debtor_id, creditor_id, amount, open_splits in balances],
+                     actor_id=actor_id, amount=sum(amount for debtor_id, creditor_id, amount, open_splits in balances))
+        bump_household_version(household_id)
+    return settled
+
+# marks every open split between two members of a household paid, in both directions, with a single update
+# returns the number of splits settled
+def settle_between(household_id, member_id, other_member_id):
+    with transaction.atomic():
+        balances = list(Balance.objects
+            .select_for_update()
+            .filter(household=household_id, open_splits__gt=0)
+            .filter(Q(debtor=member_id, creditor=other_member_id) | Q(debtor=other_member_id, creditor=member_id)))
+        settled = (Split.objects
+            .filter(expense__household=household_id, has_paid=False)
+            .filter(Q(member=member_id, expense__member=other_member_id) | Q(member=other_member_id, expense__member=member_id))
+            .update(has_paid=True))
+        if settled:
+            Balance.objects.filter(id__in=[balance.id for balance in balances]).update(amount=0, open_splits=0)
+            # what member_id owed other_member_id once both directions are netted off
+            net = sum(balance.amount if balance.debtor_id == member_id else -balance.amount for balance in balances)
+            payer_id, payee_id = (member_id, other_member_id) if net >= 0 else (other_member_id, member_id)
+            Settlement.objects.create(household_id=household_id, payer_id=payer_id, payee_id=payee_id, amount=abs(net), splits_settled=settled)
+            record_event(household_id, LedgerEvent.MEMBERS_SETTLED, [(balance.debtor_id, balance.creditor_id, -balance.amount, -balance.open_splits) for balance in balances],
+                         actor_id=member_id, counterparty_id=other_member_id, amount=abs(net))
+            bump_household_version(household_id)
+    return settled
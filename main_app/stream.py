@@ -0,0 +1,128 @@
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .models import LedgerEvent
+
+# seconds a stream waits for a wake-up before checking the event log itself,
+# which is how it hears about writes made by other processes
+def poll_interval():
+    return getattr(settings, 'STREAM_POLL_INTERVAL', 5)
+
+# streams end after this long and the browser reconnects with Last-Event-ID, so a worker thread is never held forever
+def max_stream_seconds():
+    return getattr(settings, 'STREAM_MAX_SECONDS', 300)
+
+# open streams per process, kept below the gunicorn thread count so they can't take every thread from normal requests
+def max_open_streams():
+    return getattr(settings, 'STREAM_MAX_OPEN', 16)
+
+
+# wakes this process's open streams when one of its requests records a ledger event
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.open_streams = 0
+
+    # yields whether the stream got one of the process's STREAM_MAX_OPEN slots
+    @contextmanager
+    def stream_slot(self):
+        with self.lock:
+            taken = self.open_streams < max_open_streams()
+            if taken:
+                self.open_streams += 1
+        try:
+            yield taken
+        finally:
+            if taken:
+                with self.lock:
+                    self.open_streams -= 1
+
+    @contextmanager
+    def subscribe(self, household_id):
+        wakeups = queue.Queue(maxsize=1)
+        with self.lock:
+            self.subscribers.setdefault(household_id, set()).add(wakeups)
+        try:
+            yield wakeups
+        finally:
+            with self.lock:
+                self.subscribers[household_id].discard(wakeups)
+                if not self.subscribers[household_id]:
+                    del self.subscribers[household_id]
+
+    # the events themselves are read from the database, so a subscriber that is already awake can skip the wake-up
+    def publish(self, household_id):
+        with self.lock:
+            subscribers = list(self.subscribers.get(household_id, ()))
+        for wakeups in subscribers:
+            try:
+                wakeups.put_nowait(True)
+            except queue.Full:
+                pass
+
+broker = Broker()
+
+
+# the ledger and expense delta carried by one event, as sent to the dashboard
+def event_payload(event):
+    return {
+        'id': event.id,
+        'kind': event.kind,
+        'description': str(event),
+        'date': event.date,
+        'actor': event.actor_id,
+        'expense': event.expense_id,
+        'name': event.name,
+        'amount': event.amount,
+        'changes': json.loads(event.changes),
+    }
+
+def new_events(household_id, after_id):
+    return list(LedgerEvent.objects
+        .filter(household=household_id, id__gt=after_id)
+        .select_related('actor', 'counterparty')
+        .order_by('id'))
+
+def latest_event_id(household_id):
+    return LedgerEvent.objects.filter(household=household_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+# nothing is read while a stream waits, so its connection is closed rather than held open for CONN_MAX_AGE,
+# and the next poll opens a fresh one
+def release_connections():
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+# server-sent events for every ledger event after last_event_id, as they are recorded
+# each wake-up, whether from the broker or the poll interval, is one indexed query on the event log
+def household_events(household_id, last_event_id):
+    deadline = time.monotonic() + max_stream_seconds()
+    yield f'retry: {poll_interval() * 1000}\n\n'
+    with broker.stream_slot() as taken, broker.subscribe(household_id) as wakeups:
+        # with every slot taken the stream ends straight away and the browser tries again after the retry delay
+        if not taken:
+            return
+        while True:
+            events = new_events(household_id, last_event_id)
+            for event in events:
+                last_event_id = event.id
+                yield f'id: {event.id}\nevent: ledger\ndata: {json.dumps(event_payload(event), cls=DjangoJSONEncoder)}\n\n'
+            if not events:
+                # a comment line keeps proxies from timing out an idle connection
+                yield ': keepalive\n\n'
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            release_connections()
+            try:
+                wakeups.get(timeout=min(poll_interval(), remaining))
+            except queue.Empty:
+                pass
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+
+# mix into a TestCase to fail any request that runs more queries than its view's budget in settings.QUERY_BUDGETS
+class QueryBudgetMixin:
+    def assertWithinQueryBudget(self, method, path, data=None, **extra):
+        view = resolve(path.split('?')[0]).url_name
+        budget = settings.QUERY_BUDGETS.get(view)
+        if budget is None:
+            self.fail(f'{view} has no query budget in settings.QUERY_BUDGETS')
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data or {}, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        query_count = len(queries)
+        if query_count > budget:
+            listing = '\n'.join(f"{index}. {query['sql']}" for index, query in enumerate(queries.captured_queries, start=1))
+            self.fail(f'{view} ran {query_count} queries, over its budget of {budget}:\n{listing}')
+        return response
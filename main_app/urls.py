@@ -1,21 +1,36 @@
 from django.urls import path
-from . import views
+from . import api, views
+from .metrics import metrics
 
 urlpatterns = [
   path('', views.home, name='home'),
   path('about/', views.about, name='about'),
   path('households/', views.households_index, name='households_index'),
+  path('households/search/', views.expenses_search, name='expenses_search'),
   path('households/create/', views.HouseholdCreate.as_view(), name='households_create'),
   path('households/<int:household_id>/', views.households_details, name='households_details'),
+  path('households/<int:household_id>/stream/', views.households_stream, name='households_stream'),
+  path('households/<int:household_id>/expenses/', views.households_expenses, name='households_expenses'),
+  path('households/<int:household_id>/export/', views.households_export, name='households_export'),
+  path('households/<int:household_id>/import/', views.households_import, name='households_import'),
   path('households/<int:household_id>/<int:expense_id>/', views.expenses_detail, name='expenses_detail'),
   path('households/<int:household_id>/<int:pk>/edit/', views.ExpenseUpdate.as_view(), name='expense_update'),
   path('households/<int:household_id>/<int:expense_id>/delete/', views.remove_expense, name='remove_expense'),
   path('households/<int:household_id>/update/', views.households_update, name='households_update'),
   path('households/<int:household_id>/delete/', views.households_delete, name='households_delete'),
+  path('households/<int:household_id>/settle/', views.households_settle, name='households_settle'),
+  path('households/<int:household_id>/stats/', views.households_stats, name='households_stats'),
   path('households/<int:household_id>/add_expense/', views.add_expense, name='add_expense'),
   path('households/<int:household_id>/<int:member_id>/has_paid/', views.has_paid, name='has_paid'),
   path('households/<int:household_id>/<int:split_id>/has_paid_split/', views.has_paid_split, name='has_paid_split'),
   path('users/<int:pk>/update/', views.UserUpdate.as_view(), name='user_update'),
   path('users/<int:pk>/update/add_avatar/', views.add_avatar, name='add_avatar'),
-  path('accounts/signup/', views.signup, name='signup')
+  path('accounts/signup/', views.signup, name='signup'),
+  path('api/households/', api.api_households, name='api_households'),
+  path('api/households/<int:household_id>/', api.api_household, name='api_household'),
+  path('api/households/<int:household_id>/ledger/', api.api_ledger, name='api_ledger'),
+  path('api/households/<int:household_id>/expenses/', api.api_expenses, name='api_expenses'),
+  path('api/jobs/<int:job_id>/', api.api_job, name='api_job'),
+  path('jobs/<int:job_id>/download/', views.jobs_download, name='jobs_download'),
+  path('metrics/', metrics, name='metrics'),
 ]
@@ -1,22 +1,37 @@
+import json
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
 from django.views.generic.edit import CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse
-from .forms import HouseholdForm, ExpenseForm
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from .forms import HouseholdForm, ExpenseForm, ExpenseSearchForm
 from django.urls import reverse
 from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models import Case, Count, F, Prefetch, Q, Sum, When
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from guardian.shortcuts import assign_perm, remove_perm
 
-from .models import Household, Member, Expense, Split
-
-import uuid
-import boto3
-
-S3_BASE_URL = 'https://s3-us-east-2.amazonaws.com/'
-BUCKET = 'iou2'
+from .models import Household, Member, Expense, Split, Balance, Settlement, LedgerEvent, Job, ArchivedExpense
+from .avatars import submit_avatar
+from .caching import bump_household_version, csrf_fragment_key, dashboard_cache_timeout, dashboard_etag, dashboard_key, household_version
+from .balances import get_ledger, apply_balance_changes, split_cost
+from .exports import EXPORT_FORMATS, export_rows, get_export_storage
+from .feeds import expense_page
+from .imports import parse_expenses, import_expenses
+from .jobs import enqueue
+from .ledger import household_activity, record_event
+from .membership import apply_membership_changes, members_with_open_balances, membership_changes
+from .rollups import apply_rollup_changes, expense_rollup_changes, monthly_spend, recent_months
+from .search import search_expenses, search_page
+from .routers import cache_timeout
+from .stream import household_events, latest_event_id
+from .settlement import household_net_balances, plan_settlement, settle_household, settle_between
 
 # custom form for signup
 class MemberCreationForm(UserCreationForm):
@@ -51,7 +66,19 @@ def signup(request):
 
 @login_required
 def households_index(request):
-    households = request.user.households.all()
+    # annotating before filtering keeps the member count from reusing the join that filters on the current user
+    households = list(Household.objects
+        .annotate(member_count=Count('members', distinct=True))
+        .filter(members=request.user)
+        .prefetch_related(Prefetch('members', queryset=Member.objects.only('id', 'username', 'avatar').order_by('id'))))
+    # the user's net position in every household at once: positive if they owe, negative if they are owed
+    net_by_household = dict(Balance.objects
+        .filter(Q(debtor=request.user) | Q(creditor=request.user), open_splits__gt=0)
+        .values_list('household')
+        .annotate(net=Sum(Case(When(debtor=request.user, then=F('amount')), default=-F('amount'))))
+        .order_by())
+    for household in households:
+        household.net_owed = net_by_household.get(household.id, 0)
     return render(request, 'households/index.html', {
         'user': request.user,
         'households': households
@@ -63,60 +90,40 @@ class UserUpdate(LoginRequiredMixin, UpdateView):
 
     def dispatch(self, request, *args, **kwargs):
         requested_user = self.get_object()
-        current_user = request.user
-        if current_user.has_perm("view_member", requested_user):
+        if request.perms.has_perm("view_member", requested_user):
             return super(UserUpdate, self).dispatch(request, *args, **kwargs)
         else:
             return HttpResponse(status=401)
 
 # helper function
 def get_owed(household_id, current_user_id):
-    ledger = { }
-
-    # get all splits in household by iterating through each expense on the household
-    for expense_row in Expense.objects.filter(household=household_id):
-        if expense_row.member.id == current_user_id:
-            for split_row in Split.objects.filter(expense=expense_row.id):
-                if split_row.has_paid == False:
-                    if not split_row.member in ledger:
-                        ledger[split_row.member] = 0
-                    ledger[split_row.member] -= split_row.amount_owed
-        else:
-            for split_row in Split.objects.filter(expense=expense_row.id):
-                if split_row.has_paid == False:
-                    if split_row.member.id == current_user_id:
-                        if not expense_row.member in ledger:
-                            ledger[expense_row.member] = 0
-                        ledger[expense_row.member] += split_row.amount_owed
-    return ledger
+    return get_ledger(household_id, current_user_id)
 
+# helper function
+def add_expense_permissions(request, expenses):
+    # load the user's grants on every listed expense at once to decide which edit/delete actions to show
+    request.perms.prefetch(expenses)
+    for expense_row in expenses:
+        expense_row.can_change = request.perms.has_perm("change_expense", expense_row)
+        expense_row.can_delete = request.perms.has_perm("delete_expense", expense_row)
+
+@login_required
 def has_paid(request, household_id, member_id):
-    for expense_row in Expense.objects.filter(household=household_id):
-        if expense_row.member.id == request.user.id or expense_row.member.id == member_id:
-            for split_row in Split.objects.filter(expense=expense_row.id):
-                if split_row.member.id == member_id or split_row.member.id == request.user.id:
-                    split_row.has_paid = True
-                    split_row.save()
-    return redirect('households_details', household_id=household_id)
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("view_household", household):
+        settle_between(household_id, request.user.id, member_id)
+        return redirect('households_details', household_id=household_id)
+    else:
+        return HttpResponse(status=401)
 
 def add_avatar(request, pk):
     photo_file = request.FILES.get('photo-file', None)
     member = Member.objects.get(pk=pk)
-    if request.user.has_perm("change_member", member):
+    if request.perms.has_perm("change_member", member):
         if photo_file:
-            s3 = boto3.client('s3')
-            # need a unique "key" for S3 / needs image file extension too
-            key = uuid.uuid4().hex[:6] + photo_file.name[photo_file.name.rfind('.'):]
-            # just in case something goes wrong
-            try:
-                s3.upload_fileobj(photo_file, BUCKET, key)
-                # build the full url string
-                url = f"{S3_BASE_URL}{BUCKET}/{key}"
-
-                member.avatar = url
-                member.save()
-            except:
-                print('An error occurred uploading file to S3')
+            # resizing and uploading happen on the avatar worker pool, the new avatar shows up once it's done
+            # the upload is read here because django deletes its temporary file when the request ends
+            submit_avatar(member.id, photo_file.read())
         return redirect('user_update', pk=pk)
     else:
         return HttpResponse(status=401)
@@ -124,9 +131,18 @@ def add_avatar(request, pk):
 def has_paid_split(request, household_id, split_id):
     split = Split.objects.get(id=split_id)
     expense = split.expense
-    if request.user.has_perm("change_expense", expense):
-        split.has_paid = True
-        split.save()
+    if request.perms.has_perm("change_expense", expense):
+        with transaction.atomic():
+            # claiming the split in the same statement that checks it means a double click or a concurrent
+            # settle_between that already paid it doesn't take it off the balance a second time
+            if Split.objects.filter(pk=split.pk, has_paid=False).update(has_paid=True):
+                changes = [(split.member_id, expense.member_id, -split.amount_owed, -1)]
+                apply_balance_changes(expense.household_id, changes)
+                record_event(expense.household_id, LedgerEvent.SPLIT_SETTLED, changes, actor=request.user, counterparty_id=split.member_id,
+                             expense=expense, name=expense.name, amount=split.amount_owed)
+                Settlement.objects.create(household_id=expense.household_id, payer_id=split.member_id, payee_id=expense.member_id, amount=split.amount_owed, splits_settled=1)
+                # update() skips post_save, which would have bumped the version
+                bump_household_version(expense.household_id)
         return redirect('households_details', household_id=household_id)
     else:
         return HttpResponse(status=401)
@@ -153,39 +169,155 @@ class HouseholdCreate(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+# ledger, open splits and the first page of expenses as the viewer sees them, cached until the household changes
+def dashboard_data(request, household_id, version):
+    key = dashboard_key(household_id, request.user.id, version)
+    timeout = cache_timeout(dashboard_cache_timeout())
+    data = cache.get(key) if timeout else None
+    if data is not None:
+        return data
+
+    ledger = get_owed(household_id, request.user.id).items()
+    sorted_ledger = sorted(ledger, key=lambda item: item[1], reverse=True)
+    ledger_splits = {member: [] for member, amount in ledger}
+
+    # only the first page of expenses that still have unpaid splits, the rest load through households_expenses
+    expenses, next_cursor = expense_page(household_id)
+    add_expense_permissions(request, expenses)
+
+    # populate ledger_splits with every unpaid split between the user and the members in the ledger
+    counterparties = {member.id: member for member in ledger_splits}
+    open_splits = (Split.objects
+        .filter(expense__household=household_id, has_paid=False)
+        .filter(Q(member=request.user.id) | Q(expense__member=request.user.id))
+        .select_related('member', 'expense__member')
+        .order_by('-expense__member', 'id'))
+    for split_row in open_splits:
+        counterparty_id = split_row.expense.member_id if split_row.member_id == request.user.id else split_row.member_id
+        if counterparty_id in counterparties:
+            ledger_splits[counterparties[counterparty_id]].append(split_row)
+
+    data = {
+        'expenses': expenses,
+        'next_cursor': next_cursor,
+        'ledger': sorted_ledger,
+        'ledger_splits': list(ledger_splits.items()),
+        'activity': household_activity(household_id, 10),
+    }
+    if timeout:
+        cache.set(key, data, timeout)
+    return data
+
 @login_required
 def households_details(request, household_id):
     household = Household.objects.get(pk=household_id)
 
-    if request.user.has_perm("view_household", household):
-        expense_form = ExpenseForm()
-        ledger = get_owed(household_id, request.user.id).items()
-        sorted_ledger = sorted(ledger, key=lambda item: item[1], reverse=True)
-        ledger_splits = { }
-        expenses = []
-
-        # filter out expenses that have been paid for
-        for expense_row in Expense.objects.filter(household=household_id):
-            for split_row in Split.objects.filter(expense=expense_row):
-                if split_row.has_paid == False:
-                      if not expense_row in expenses:
-                          expenses.append(expense_row)
-
-        # populate populate ledger_splits with members related to the ledger
-        for member, amount in ledger:
-            member_splits = list(Split.objects.filter(expense__household=household_id, expense__member=member.id, member=request.user.id, has_paid=False))
-            user_splits = list(Split.objects.filter(expense__household=household_id, expense__member=request.user.id, member=member.id, has_paid=False))
-            ledger_splits[member] = member_splits + user_splits
-        is_admin = request.user.has_perm("change_household", household)
-
-        return render(request, 'households/details.html', {
+    # permissions are checked before the conditional headers, so a 401 never carries the household's ETag
+    if request.perms.has_perm("view_household", household):
+        return household_dashboard(request, household)
+    else:
+        return HttpResponse(status=401)
+
+# browsers revalidate with the household version as the ETag and get a 304 when nothing has changed
+# a 304 isn't free, it still runs the session, household and permission queries a cached dashboard does and only
+# saves rendering and sending the page
+@condition(etag_func=lambda request, household: dashboard_etag(request, household.id))
+def household_dashboard(request, household):
+    version = household_version(household.id)
+    is_admin = request.perms.has_perm("change_household", household)
+    data = dashboard_data(request, household.id, version)
+
+    response = render(request, 'households/details.html', {
+        'user': request.user,
+        "is_admin": is_admin,
+        'household': household,
+        'expense_form': ExpenseForm(),
+        'version': version,
+        'csrf_key': csrf_fragment_key(request),
+        'cache_timeout': cache_timeout(dashboard_cache_timeout()),
+        **data,
+        # the live stream picks up after the newest event the page shows
+        'stream_after': data['activity'][0].id if data['activity'] else 0,
+    })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# ledger and expense deltas for an open dashboard as server-sent events, so members don't reload to see changes
+# ?after is the newest event the page was rendered with, reconnects resume from the browser's Last-Event-ID
+@login_required
+def households_stream(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    # checked when the stream opens and again on every reconnect, not while it runs
+    if request.perms.has_perm("view_household", household):
+        try:
+            after = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('after') or latest_event_id(household_id))
+        except ValueError:
+            return HttpResponse(status=400)
+        response = StreamingHttpResponse(household_events(household_id, after), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # stops nginx style proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    else:
+        return HttpResponse(status=401)
+
+@login_required
+def households_expenses(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("view_household", household):
+        try:
+            expenses, next_cursor = expense_page(household_id, request.GET.get('after'))
+        except ValueError:
+            return HttpResponse(status=400)
+        add_expense_permissions(request, expenses)
+        return render(request, 'households/expense_feed.html', {
             'user': request.user,
-            "is_admin": is_admin,
             'household': household,
             'expenses': expenses,
-            'expense_form': expense_form,
-            'ledger': sorted_ledger,
-            'ledger_splits': ledger_splits.items()
+            'next_cursor': next_cursor
+        })
+    else:
+        return HttpResponse(status=401)
+
+@login_required
+def households_export(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("view_household", household):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return HttpResponse(status=400)
+        if request.GET.get('background'):
+            job = enqueue(Job.EXPORT_HOUSEHOLD, requested_by=request.user, household_id=household_id, format=export_format)
+            return JsonResponse({'job': job.id, 'status': reverse('api_job', args=[job.id])}, status=202)
+        lines, content_type = EXPORT_FORMATS[export_format]
+        # rows are streamed from a chunked cursor so memory stays flat no matter how much history the household has
+        response = StreamingHttpResponse(lines(export_rows(household_id)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="household_{household_id}.{export_format}"'
+        return response
+    else:
+        return HttpResponse(status=401)
+
+@login_required
+def households_import(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("change_household", household):
+        errors = []
+        if request.method == "POST":
+            csv_file = request.FILES.get('csv-file', None)
+            if csv_file:
+                lines = (line.decode('utf-8-sig') for line in csv_file)
+                try:
+                    expenses, errors = parse_expenses(household, lines, request.user)
+                except UnicodeDecodeError:
+                    expenses, errors = [], [(None, 'The CSV file must be saved as UTF-8.')]
+                # nothing is saved unless every row is valid
+                if not errors:
+                    import_expenses(household, expenses, request.user.id)
+                    return redirect('households_details', household_id=household_id)
+            else:
+                errors = [(None, 'Choose a CSV file to import.')]
+        return render(request, 'households/import.html', {
+            'household': household, 'errors': errors
         })
     else:
         return HttpResponse(status=401)
@@ -193,27 +325,20 @@ def households_details(request, household_id):
 @login_required
 def households_update(request, household_id):
     household = Household.objects.get(pk=household_id)
-    if request.user.has_perm("change_household", household):
+    if request.perms.has_perm("change_household", household):
         if request.method == "POST":
-            previous_household_members = household.members.all()
-            household_group = Group.objects.get(name=f'household_{household_id}')
+            # validating the form copies the new name onto the instance
+            previous_name = household.name
             form = HouseholdForm(request.POST, instance=household)
             if form.is_valid():
-                new_household_members = form.cleaned_data["members"].all()
-                removed_members = previous_household_members.difference(new_household_members)
-                ledger = get_owed(household_id, request.user.id)
-                print(ledger)
-                for removed_member in removed_members:
-                    if removed_member.id == request.user.id:
-                        return HttpResponse(status=403)
-                    if removed_member in ledger:
+                with transaction.atomic():
+                    added, removed = membership_changes(household_id, [member.id for member in form.cleaned_data["members"]])
+                    # nobody can remove themselves, or anyone who still owes or is owed money in the household
+                    if request.user.id in removed or members_with_open_balances(household_id, removed):
                         return HttpResponse(status=403)
-                for removed_member in removed_members:
-                    household_group.user_set.remove(removed_member)
-                added_members = new_household_members.difference(previous_household_members)
-                for added_member in added_members:
-                    household_group.user_set.add(added_member)
-                form.save()
+                    if household.name != previous_name:
+                        household.save(update_fields=['name'])
+                    apply_membership_changes(household_id, added, removed)
             return redirect('households_details', household_id=household_id)
         # GET request
         household_form = HouseholdForm(initial={
@@ -226,36 +351,129 @@ def households_update(request, household_id):
     else:
         return HttpResponse(status=401)
 
-# TODO
+@login_required
+def households_settle(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("view_household", household):
+        if request.method == "POST":
+            # settling the whole household marks every open split as paid, so only admins can do it
+            if not request.perms.has_perm("change_household", household):
+                return HttpResponse(status=401)
+            settle_household(household_id, request.user.id)
+            return redirect('households_details', household_id=household_id)
+        transfers = plan_settlement(household_net_balances(household_id))
+        members = Member.objects.in_bulk({member_id for transfer in transfers for member_id in transfer[:2]})
+        return render(request, 'households/settle.html', {
+            'household': household,
+            'is_admin': request.perms.has_perm("change_household", household),
+            'transfers': [(members[debtor_id], members[creditor_id], amount) for debtor_id, creditor_id, amount in transfers]
+        })
+    else:
+        return HttpResponse(status=401)
+
+@login_required
+def households_stats(request, household_id):
+    household = Household.objects.get(pk=household_id)
+    if request.perms.has_perm("view_household", household):
+        try:
+            months = min(max(int(request.GET.get('months', 6)), 1), 24)
+        except ValueError:
+            return HttpResponse(status=400)
+        # reads only the pre-aggregated monthly rows, however many expenses the household has
+        by_month = monthly_spend(household_id, recent_months(months))
+        largest = max([max(row.paid, row.share) for rows in by_month.values() for row in rows] or [0]) or 1
+        totals = {}
+        for rows in by_month.values():
+            for row in rows:
+                paid, share, count = totals.get(row.member, (0, 0, 0))
+                totals[row.member] = (paid + row.paid, share + row.share, count + row.expenses)
+        return render(request, 'households/stats.html', {
+            'household': household,
+            'months': months,
+            'month_choices': [3, 6, 12, 24],
+            'by_month': [(month, [(row, row.paid * 100 / largest, row.share * 100 / largest) for row in rows]) for month, rows in reversed(list(by_month.items()))],
+            'totals': sorted(totals.items(), key=lambda item: item[1][1], reverse=True),
+        })
+    else:
+        return HttpResponse(status=401)
+
+@login_required
+def expenses_search(request):
+    # membership is what grants view_household, so the user's households are the search scope
+    households = Household.objects.filter(members=request.user).order_by('name')
+    form = ExpenseSearchForm(request.GET or None, households=households)
+    expenses, next_cursor = [], None
+    if form.is_valid():
+        filters = form.cleaned_data
+        household_ids = [filters['household'].id] if filters['household'] else list(households.values_list('id', flat=True))
+        try:
+            after = int(request.GET.get('after') or 0)
+        except ValueError:
+            return HttpResponse(status=400)
+        results = search_expenses(household_ids, filters['q'], filters['member'], filters['date_from'], filters['date_to'], filters['min_cost'], filters['max_cost'])
+        expenses, next_cursor = search_page(results, after)
+    query = request.GET.copy()
+    query.pop('after', None)
+    return render(request, 'expense/search.html', {
+        'form': form,
+        'expenses': expenses,
+        'next_cursor': next_cursor,
+        'query': query.urlencode(),
+    })
+
+# members lose access straight away, the expenses, splits and permissions are deleted in batches by the job worker
+@login_required
 def households_delete(request, household_id):
     household = Household.objects.get(pk=household_id)
-    if request.user.has_perm("delete_household", household):
-        household_groups = Group.objects.filter(name__in=[f"household_{household_id}", f"household_{household_id}_admins"])
-        household_groups.delete()
-        household.delete()
+    if request.perms.has_perm("delete_household", household):
+        with transaction.atomic():
+            household_groups = Group.objects.filter(name__in=[f"household_{household_id}", f"household_{household_id}_admins"])
+            household_groups.delete()
+            apply_membership_changes(household_id, set(), set(household.members.values_list('id', flat=True)))
+            enqueue(Job.DELETE_HOUSEHOLD, requested_by=request.user, household_id=household_id)
         return redirect("households_index")
     else:
         return HttpResponse(status=401)
 
+# the file a finished background export wrote, for the member who asked for it
+@login_required
+def jobs_download(request, job_id):
+    job = Job.objects.filter(pk=job_id, requested_by=request.user, kind=Job.EXPORT_HOUSEHOLD, status=Job.DONE).first()
+    if job is None:
+        raise Http404
+    arguments = json.loads(job.arguments)
+    return FileResponse(get_export_storage().open(job.result), as_attachment=True,
+                        filename=f"household_{arguments['household_id']}.{arguments.get('format', 'csv')}")
+
 @login_required
 def add_expense(request, household_id):
     household = Household.objects.get(pk=household_id)
-    if request.user.has_perm("view_household", household):
+    if request.perms.has_perm("view_household", household):
         form = ExpenseForm(request.POST)
         if form.is_valid():
-            new_expense = form.save(commit=False)
-            new_expense.member_id = request.user.id
-            new_expense.household_id = household_id
-            new_expense.save()
-            # give expense creator permission to update/delete
-            # add and view permissions on expenses are not needed for any authenticaed user since we assume if they can view the household they have those permissions
-            assign_perm("change_expense", request.user, new_expense)
-            assign_perm("delete_expense", request.user, new_expense)
-            household_members = new_expense.household.members.exclude(id=request.user.id)
-            AMOUNTOWED = new_expense.cost / (household_members.count() + 1)
-            for member in household_members:
-                new_split = Split(amount_owed=AMOUNTOWED, member=member, expense=new_expense)
-                new_split.save()
+            with transaction.atomic():
+                new_expense = form.save(commit=False)
+                new_expense.member_id = request.user.id
+                new_expense.household_id = household_id
+                new_expense.save()
+                # give expense creator permission to update/delete
+                # add and view permissions on expenses are not needed for any authenticaed user since we assume if they can view the household they have those permissions
+                assign_perm("change_expense", request.user, new_expense)
+                assign_perm("delete_expense", request.user, new_expense)
+                household_member_ids = list(household.members.exclude(id=request.user.id).order_by('id').values_list('id', flat=True))
+                # the creator keeps the first share, which carries any leftover cent
+                shares = split_cost(new_expense.cost, len(household_member_ids) + 1)[1:]
+                new_splits = [
+                    Split(amount_owed=share, member_id=member_id, expense=new_expense)
+                    for member_id, share in zip(household_member_ids, shares)
+                ]
+                Split.objects.bulk_create(new_splits)
+                changes = [(split.member_id, request.user.id, split.amount_owed, 1) for split in new_splits]
+                apply_balance_changes(household_id, changes)
+                record_event(household_id, LedgerEvent.EXPENSE_ADDED, changes, actor=request.user, expense=new_expense,
+                             name=new_expense.name, amount=new_expense.cost)
+                apply_rollup_changes(household_id, expense_rollup_changes(request.user.id, new_expense.date, new_expense.cost,
+                                                                          [(split.member_id, split.amount_owed) for split in new_splits]))
         return redirect('households_details', household_id=household_id)
     else:
         return HttpResponse(status=401)
@@ -263,8 +481,16 @@ def add_expense(request, household_id):
 @login_required
 def expenses_detail(request, household_id, expense_id):
     household = Household.objects.get(id=household_id)
-    if request.user.has_perm("view_household", household):
-        expense = Expense.objects.get(id=expense_id)
+    if request.perms.has_perm("view_household", household):
+        expense = Expense.objects.filter(id=expense_id).first()
+        if expense is None:
+            # settled expenses move to the archive after a while and are shown read-only from there
+            expense = ArchivedExpense.objects.select_related('member').get(id=expense_id, household=household_id)
+            return render(request, 'expense/details.html', {
+                'expense': expense,
+                'household': household,
+                'archived': True,
+            })
         split = Split.objects.filter(expense=expense_id)
         return render(request, 'expense/details.html', {
             'expense': expense,
@@ -277,10 +503,18 @@ def expenses_detail(request, household_id, expense_id):
 @login_required
 def remove_expense(request, household_id, expense_id):
     expense = Expense.objects.get(id=expense_id)
-    if request.user.has_perm("delete_expense", expense):
-        remove_perm("change_expense", request.user, expense)
-        remove_perm("delete_expense", request.user, expense)
-        expense.delete()
+    if request.perms.has_perm("delete_expense", expense):
+        with transaction.atomic():
+            remove_perm("change_expense", request.user, expense)
+            remove_perm("delete_expense", request.user, expense)
+            splits = list(Split.objects.filter(expense=expense).values_list('member', 'amount_owed', 'has_paid'))
+            changes = [(member_id, expense.member_id, -amount_owed, -1) for member_id, amount_owed, has_paid in splits if not has_paid]
+            apply_balance_changes(expense.household_id, changes)
+            record_event(expense.household_id, LedgerEvent.EXPENSE_REMOVED, changes, actor=request.user, expense=expense,
+                         name=expense.name, amount=expense.cost)
+            apply_rollup_changes(expense.household_id, expense_rollup_changes(expense.member_id, expense.date, expense.cost,
+                                                                              [(member_id, amount_owed) for member_id, amount_owed, has_paid in splits], sign=-1))
+            expense.delete()
         return redirect('households_details', household_id=household_id)
     else:
         return HttpResponse(status=401)
@@ -292,18 +526,32 @@ class ExpenseUpdate(LoginRequiredMixin, UpdateView):
     def dispatch(self, request, *args, **kwargs):
         print("dispatch")
         requested_expense = self.get_object()
-        current_user = request.user
-        if current_user.has_perm("change_expense", requested_expense):
+        if request.perms.has_perm("change_expense", requested_expense):
             return super(ExpenseUpdate, self).dispatch(request, *args, **kwargs)
         else:
             return HttpResponse(status=401)
 
     def form_valid(self, form):
         print("form_valid")
-        updated_expense = form.save()
-        splits = Split.objects.filter(expense=updated_expense)
-        print(splits.count())
-        splits.update(amount_owed=updated_expense.cost / (splits.count() + 1))
+        with transaction.atomic():
+            updated_expense = form.save()
+            splits = list(Split.objects.filter(expense=updated_expense).order_by('member_id'))
+            shares = split_cost(updated_expense.cost, len(splits) + 1)[1:]
+            # the form has already set the new cost on the expense, its initial data still holds the old one
+            rollup_changes = expense_rollup_changes(updated_expense.member_id, updated_expense.date, form.initial['cost'],
+                                                    [(split.member_id, split.amount_owed) for split in splits], sign=-1)
+            changes = []
+            for split, share in zip(splits, shares):
+                if split.has_paid == False:
+                    changes.append((split.member_id, updated_expense.member_id, share - split.amount_owed, 0))
+                split.amount_owed = share
+            apply_balance_changes(updated_expense.household_id, changes)
+            Split.objects.bulk_update(splits, ['amount_owed'])
+            record_event(updated_expense.household_id, LedgerEvent.EXPENSE_EDITED, changes, actor=self.request.user, expense=updated_expense,
+                         name=updated_expense.name, amount=updated_expense.cost)
+            rollup_changes += expense_rollup_changes(updated_expense.member_id, updated_expense.date, updated_expense.cost,
+                                                     [(split.member_id, split.amount_owed) for split in splits])
+            apply_rollup_changes(updated_expense.household_id, rollup_changes)
         return super().form_valid(form)
 
     def get_success_url(self, **kwargs):